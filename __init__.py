@@ -1,5 +1,7 @@
 # 打印一个清晰的加载提示，方便在启动ComfyUI时确认节点包是否被加载
 print("Initializing comfyui_vidu_api nodes...")
+import time
+_load_started = time.perf_counter()
 
 # 从您的主py文件中导入我们创建的所有节点类
 from .vidu_nodes import (
@@ -9,6 +11,10 @@ from .vidu_nodes import (
     ViduReference2VideoNode,
     ViduStartEnd2VideoNode,
     ViduFeaturedPresetNode,
+    ViduBatchNode,
+    ViduTaskRecoveryNode,
+    resume_unfinished_tasks,
+    register_metrics_route,
 )
 
 # 定义一个字典，将节点的内部名称映射到它们的类
@@ -19,6 +25,8 @@ NODE_CLASS_MAPPINGS = {
     "ViduReference2Video": ViduReference2VideoNode,
     "ViduStartEnd2Video": ViduStartEnd2VideoNode,
     "ViduFeaturedPreset": ViduFeaturedPresetNode,
+    "ViduBatch": ViduBatchNode,
+    "ViduTaskRecovery": ViduTaskRecoveryNode,
 }
 
 # 定义显示名称，创建子菜单
@@ -29,10 +37,18 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "ViduReference2Video": "comfyui_vidu_api/参考生视频",
     "ViduStartEnd2Video": "comfyui_vidu_api/首尾帧生视频",
     "ViduFeaturedPreset": "comfyui_vidu_api/特色预设",
+    "ViduBatch": "comfyui_vidu_api/批量生成",
+    "ViduTaskRecovery": "comfyui_vidu_api/任务恢复",
 }
 
+# 在后台继续处理上次退出时尚未完成的任务 (轮询与下载)
+resume_unfinished_tasks()
+
+# 注册 GET /vidu/metrics, 以 Prometheus 文本格式导出各阶段耗时与计数
+register_metrics_route()
+
 # 打印加载成功的信息
-print("✅ comfyui_vidu_api nodes loaded successfully!")
+print(f"✅ comfyui_vidu_api nodes loaded successfully! (加载耗时 {(time.perf_counter() - _load_started) * 1000:.1f} ms)")
 
 # 这是Python模块的标准部分，确保ComfyUI可以正确地导入上面的两个字典
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
\ No newline at end of file
@@ -0,0 +1,62 @@
+# 启动耗时基准: 在全新的子进程中测量导入节点包的耗时, 并统计构造大量节点 (大型工作流) 的耗时与配置文件读取次数
+# 需要在 ComfyUI 的 Python 环境中运行, 例如:
+#   python custom_nodes/comfyui_vidu_api_node/benchmarks/bench_startup.py --comfyui . --nodes 500
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+NODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import sys, time
+sys.path[:0] = [{comfyui!r}, {node_dir!r}]
+import comfy.comfy_types
+started = time.perf_counter()
+import vidu_nodes
+elapsed = time.perf_counter() - started
+heavy = [name for name in ("requests", "PIL", "comfy_api.input_impl") if name in sys.modules]
+print(f"{{elapsed * 1000:.2f}}|{{','.join(heavy)}}")
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Vidu 节点包启动与节点构造耗时")
+    parser.add_argument("--comfyui", default=".", help="ComfyUI 根目录 (用于导入 comfy 模块)")
+    parser.add_argument("--repeat", type=int, default=5, help="导入测量次数 (每次一个新进程)")
+    parser.add_argument("--nodes", type=int, default=500, help="构造的节点实例数")
+    args = parser.parse_args()
+    comfyui = os.path.abspath(args.comfyui)
+
+    # 导入耗时只计 vidu_nodes 本身, comfy 基础模块在计时前已导入 (ComfyUI 启动时本来就会加载)
+    samples, heavy = [], ""
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(comfyui=comfyui, node_dir=NODE_DIR)], capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+        elapsed, heavy = output.split("|"); samples.append(float(elapsed))
+    samples.sort()
+    print(f"导入 vidu_nodes: 中位数 {samples[len(samples) // 2]:.2f} ms, 最小 {samples[0]:.2f} ms, 最大 {samples[-1]:.2f} ms")
+    print(f"导入后已加载的重量级依赖: {heavy or '无'}")
+
+    work_dir = tempfile.mkdtemp(prefix="vidu_startup_")
+    config_path = os.path.join(work_dir, "api.json")
+    with open(config_path, "w", encoding="utf-8") as f: json.dump({"api_key": "bench"}, f)
+    os.environ["VIDU_API_CONFIG"] = config_path
+    sys.path[:0] = [comfyui, NODE_DIR]
+    import vidu_nodes
+
+    # 统计构造期间打开配置文件的次数, 确认配置只在进程内解析一次
+    opens, real_open = [0], open
+    def counting_open(path, *a, **kw):
+        if os.path.abspath(str(path)) == config_path: opens[0] += 1
+        return real_open(path, *a, **kw)
+    vidu_nodes.open = counting_open
+    classes = [cls for cls in vidu_nodes.NODE_CLASS_MAPPINGS.values()]
+    started = time.perf_counter()
+    for index in range(args.nodes): classes[index % len(classes)]()
+    elapsed = time.perf_counter() - started
+    print(f"构造 {args.nodes} 个节点: 共 {elapsed * 1000:.1f} ms, 平均 {elapsed / args.nodes * 1e6:.1f} µs/个, 读取配置文件 {opens[0]} 次")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# 端到端吞吐基准: 在本地模拟 Vidu 服务上以 N 个并发任务驱动各生成节点, 报告各阶段 p50/p95 耗时与每分钟完成任务数
+# 需要在 ComfyUI 的 Python 环境中运行, 例如:
+#   python custom_nodes/comfyui_vidu_api_node/benchmarks/bench_throughput.py --comfyui . --jobs 40 --concurrency 20
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+NODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_vidu_server import start_mock_server
+
+def node_inputs(name: str, index: int, make_image) -> dict:
+    common = {"提示词": f"基准测试任务 {index}", "随机种子": index, "分辨率": "1080p", "动态幅度": "自动", "使用结果缓存": False}
+    return {
+        "ViduText2VideoNode": lambda: {**common, "运行配置": "viduq1 - 5秒", "风格": "通用", "宽高比": "16:9"},
+        "ViduImage2VideoNode": lambda: {**common, "运行配置": "viduq1 - 5秒", "图像": make_image()},
+        "ViduReference2VideoNode": lambda: {**common, "运行配置": "vidu1.5 - 4秒", "宽高比": "16:9", "参考图_1": make_image(), "参考图_2": make_image(), "参考图_3": make_image()},
+        "ViduStartEnd2VideoNode": lambda: {**common, "运行配置": "viduq1 - 5秒", "起始帧": make_image(), "结束帧": make_image()},
+        "ViduFeaturedPresetNode": lambda: {**common, "预设模板": "outfit_show", "图像_1": make_image(), "图像_2": make_image(), "背景音乐": True, "额外JSON参数": "{}"},
+    }[name]()
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser(description="Vidu 节点端到端吞吐基准 (本地模拟服务)")
+    parser.add_argument("--comfyui", default=".", help="ComfyUI 根目录 (用于导入 comfy 模块)")
+    parser.add_argument("--nodes", default="ViduText2VideoNode,ViduImage2VideoNode,ViduReference2VideoNode,ViduStartEnd2VideoNode,ViduFeaturedPresetNode")
+    parser.add_argument("--jobs", type=int, default=20, help="每个节点类提交的任务数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--image-size", default="1280x720")
+    parser.add_argument("--render-delay", type=float, default=5.0)
+    parser.add_argument("--queue-delay", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--video-size", type=int, default=4 << 20)
+    parser.add_argument("--poll-initial", type=float, default=0.5)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="vidu_bench_")
+    server, base_url, state = start_mock_server(render_delay=args.render_delay, queue_delay=args.queue_delay, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, bandwidth=args.bandwidth, video_size=args.video_size)
+    # 基准使用独立的配置文件: 关闭所有缓存与任务日志, 打开逐任务的阶段记录
+    config = {"api_key": "mock", "upload_cache": {"enabled": False}, "result_cache": {"enabled": False}, "journal": {"enabled": False},
+              "scheduler": {"poll_initial": args.poll_initial, "poll_workers": max(8, args.concurrency)}, "http": {"pool_size": max(32, args.concurrency * 2)},
+              "metrics": {"trace_dir": os.path.join(work_dir, "traces")}}
+    config_path = os.path.join(work_dir, "api.json")
+    with open(config_path, "w", encoding="utf-8") as f: json.dump(config, f)
+    os.environ["VIDU_API_CONFIG"] = config_path
+    sys.path[:0] = [os.path.abspath(args.comfyui), NODE_DIR]
+    import torch
+    import vidu_nodes
+
+    width, height = (int(x) for x in args.image_size.lower().split("x"))
+    make_image = lambda: torch.rand(1, height, width, 3)
+    print(f"模拟服务: {base_url}, 渲染 {args.render_delay}s, 排队 {args.queue_delay}s, 错误率 {args.error_rate}, 429 比例 {args.rate_limit_rate}")
+    print(f"{'节点':<26}{'任务':>6}{'失败':>6}{'p50 s':>9}{'p95 s':>9}{'任务/分钟':>11}")
+    all_traces_before = set()
+    for name in args.nodes.split(","):
+        node_cls = getattr(vidu_nodes, name.strip())
+        def run(index: int):
+            node = node_cls(); start = time.perf_counter()
+            result = node.generate(**{**node_inputs(node_cls.__name__, index, make_image), "API地址": base_url, "输出路径": os.path.join(work_dir, "videos"), "文件名前缀": f"bench_{index}"})
+            return time.perf_counter() - start, result[2] != "error"
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool: results = list(pool.map(run, range(args.jobs)))
+        wall = time.perf_counter() - started
+        latencies, failures = [r[0] for r in results], sum(1 for r in results if not r[1])
+        print(f"{node_cls.__name__:<26}{args.jobs:>6}{failures:>6}{percentile(latencies, 0.5):>9.2f}{percentile(latencies, 0.95):>9.2f}{(args.jobs - failures) / wall * 60:>11.1f}")
+
+        stages, trace_files = {}, set(glob.glob(os.path.join(work_dir, "traces", "*.jsonl"))) - all_traces_before
+        all_traces_before |= trace_files
+        for path in trace_files:
+            with open(path, encoding="utf-8") as f:
+                for line in f: record = json.loads(line); stages.setdefault(record["stage"], []).append(record["duration_ms"] / 1000)
+        for stage, values in sorted(stages.items()):
+            print(f"    {stage:<22}{len(values):>6}{'':>6}{percentile(values, 0.5):>9.3f}{percentile(values, 0.95):>9.3f}")
+    print(f"模拟服务请求计数: {json.dumps(state.counters, ensure_ascii=False)}")
+    print(f"HTTP 连接池: {vidu_nodes.get_http_client().stats()}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# 上传图片编码基准: 对比各编码模式的耗时 (ms) 与上传体积 (bytes)
+# 需要在 ComfyUI 的 Python 环境中运行, 例如:
+#   python custom_nodes/comfyui_vidu_api_node/benchmarks/bench_upload_encode.py --comfyui . --size 1920x1080
+import argparse
+import os
+import statistics
+import sys
+import time
+
+NODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = [
+    ("png level 6 (默认)", {"format": "png", "png_compress_level": 6}, None),
+    ("png level 1", {"format": "png", "png_compress_level": 1}, None),
+    ("png level 1 + 缩放到720p", {"format": "png", "png_compress_level": 1, "downscale": True}, "720p"),
+    ("jpeg q95", {"format": "jpeg", "quality": 95}, None),
+    ("jpeg q95 + 缩放到720p", {"format": "jpeg", "quality": 95, "downscale": True}, "720p"),
+    ("webp q95", {"format": "webp", "quality": 95}, None),
+]
+
+def load_image(args, torch):
+    if args.image:
+        import numpy as np
+        from PIL import Image
+        return torch.from_numpy(np.asarray(Image.open(args.image).convert("RGB"), dtype=np.float32) / 255.0).unsqueeze(0)
+    # 平滑渐变叠加少量噪声, 压缩特性接近真实照片 (纯随机噪声会让 PNG 体积失真)
+    width, height = (int(x) for x in args.size.lower().split("x"))
+    ys, xs = torch.linspace(0, 1, height).view(-1, 1, 1), torch.linspace(0, 1, width).view(1, -1, 1)
+    image = torch.cat([xs.expand(height, width, 1), ys.expand(height, width, 1), ((xs + ys) / 2).expand(height, width, 1)], dim=2)
+    return (image + torch.rand(height, width, 3) * 0.05).clamp(0, 1).unsqueeze(0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Vidu 上传图片编码基准")
+    parser.add_argument("--comfyui", default=".", help="ComfyUI 根目录 (用于导入 comfy 模块)")
+    parser.add_argument("--image", default=None, help="使用指定图片代替合成图像")
+    parser.add_argument("--size", default="1920x1080", help="合成图像尺寸, 如 3840x2160")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    sys.path[:0] = [os.path.abspath(args.comfyui), NODE_DIR]
+    import torch
+    import vidu_nodes
+
+    image = load_image(args, torch)
+    print(f"输入图像: {tuple(image.shape)}, 每种模式重复 {args.repeat} 次")
+    print(f"{'模式':<28}{'编码 ms (中位数)':>18}{'上传 bytes':>14}")
+    for name, overrides, resolution in MODES:
+        settings, timings = {**vidu_nodes.DEFAULT_UPLOAD_SETTINGS, **overrides}, []
+        for _ in range(args.repeat):
+            start = time.perf_counter(); body, _ = vidu_nodes.encode_image(image, settings, resolution); timings.append((time.perf_counter() - start) * 1000)
+        print(f"{name:<28}{statistics.median(timings):>18.1f}{body.getbuffer().nbytes:>14,}")
+
+if __name__ == "__main__":
+    main()
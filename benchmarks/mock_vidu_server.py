@@ -0,0 +1,164 @@
+# 本地模拟 Vidu API, 用于离线回归测试与吞吐基准, 不消耗真实额度
+# 实现: 上传许可 / PUT 上传 / 完成上传 / 五个生成接口 / 提示词推荐 / 任务状态查询 / 取消任务 / 视频下载 (支持 Range)
+# 注意: 下载得到的是指定大小的占位字节, 不是可以播放的视频
+#   python benchmarks/mock_vidu_server.py --port 8765 --render-delay 10 --error-rate 0.02 --rate-limit-rate 0.05
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GENERATION_ENDPOINTS = ("text2video", "img2video", "reference2video", "start-end2video", "template2video")
+
+class MockViduState:
+    def __init__(self, render_delay: float = 5.0, queue_delay: float = 1.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0, bandwidth: int = 0, video_size: int = 4 << 20):
+        self.render_delay, self.queue_delay, self.error_rate, self.rate_limit_rate = render_delay, queue_delay, error_rate, rate_limit_rate
+        self.bandwidth, self.video_size = bandwidth, video_size
+        self.lock, self.tasks, self.uploads, self.counters = threading.Lock(), {}, {}, {}
+        self.video = bytes(random.Random(0).getrandbits(8) for _ in range(min(video_size, 1 << 16)))
+        self.video = (self.video * (video_size // len(self.video) + 1))[:video_size]
+        self.video_etag = hashlib.md5(self.video).hexdigest()
+    def count(self, name: str):
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + 1
+    def task_state(self, task_id: str):
+        with self.lock: task = self.tasks.get(task_id)
+        if task is None: return None
+        if task["cancelled"]: return "cancelled"
+        elapsed = time.time() - task["created"]
+        if elapsed < self.queue_delay: return "queueing"
+        return "processing" if elapsed < self.queue_delay + self.render_delay else "success"
+
+class MockViduHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockViduState = None
+
+    def log_message(self, format, *args): pass
+
+    @property
+    def base_url(self) -> str: return f"http://{self.headers.get('Host')}"
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status); self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers(); self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _inject_failure(self) -> bool:
+        # 对 API 请求按概率注入 429 (带 Retry-After) 或 500
+        roll = random.random()
+        if roll < self.state.rate_limit_rate: self.state.count("injected_429"); self._send_json(429, {"message": "rate limited"}, {"Retry-After": "1"}); return True
+        if roll < self.state.rate_limit_rate + self.state.error_rate: self.state.count("injected_500"); self._send_json(500, {"message": "injected error"}); return True
+        return False
+
+    def _authorized(self) -> bool:
+        if (self.headers.get("Authorization") or "").startswith("Token "): return True
+        self._send_json(401, {"message": "missing token"}); return False
+
+    def do_POST(self):
+        body, path = self._read_body(), self.path.split("?")[0]
+        if not self._authorized() or self._inject_failure(): return
+        self.state.count(f"POST {path}")
+        if path == "/tools/v2/files/uploads":
+            resource_id = uuid.uuid4().hex
+            with self.state.lock: self.state.uploads[resource_id] = None
+            return self._send_json(200, {"id": resource_id, "put_url": f"{self.base_url}/mock-upload/{resource_id}"})
+        match = re.fullmatch(r"/ent/v2/tasks/([^/]+)/cancel", path)
+        if match:
+            with self.state.lock: task = self.state.tasks.get(match.group(1))
+            if task is None: return self._send_json(404, {"message": "task not found"})
+            task["cancelled"] = True; return self._send_json(200, {})
+        if path == "/ent/v2/img2video-prompt-recommendation":
+            return self._send_json(200, {"prompts": [{"type": "img2video", "content": "镜头缓慢推进。"}, {"type": "template", "content": "换装", "template": "outfit_show", "resolution": "720p", "prompt": "模特展示服装"}]})
+        if path.startswith("/ent/v2/") and path[len("/ent/v2/"):] in GENERATION_ENDPOINTS:
+            task_id = str(random.randint(10 ** 17, 10 ** 18 - 1))
+            with self.state.lock: self.state.tasks[task_id] = {"created": time.time(), "cancelled": False, "payload": json.loads(body or b"{}")}
+            return self._send_json(200, {"task_id": task_id, "state": "created"})
+        self._send_json(404, {"message": f"unknown endpoint {path}"})
+
+    def do_PUT(self):
+        body, path = self._read_body(), self.path.split("?")[0]
+        match = re.fullmatch(r"/mock-upload/([^/]+)", path)
+        if match:
+            with self.state.lock: known = match.group(1) in self.state.uploads
+            if not known: return self._send_json(404, {"message": "unknown upload"})
+            etag = hashlib.md5(body).hexdigest()
+            with self.state.lock: self.state.uploads[match.group(1)] = etag
+            self.state.count("PUT upload"); self.send_response(200); self.send_header("ETag", f'"{etag}"'); self.send_header("Content-Length", "0"); self.end_headers(); return
+        if not self._authorized() or self._inject_failure(): return
+        match = re.fullmatch(r"/tools/v2/files/uploads/([^/]+)/finish", path)
+        if match:
+            with self.state.lock: expected = self.state.uploads.get(match.group(1))
+            if expected is None or json.loads(body or b"{}").get("etag") != expected: return self._send_json(400, {"message": "etag mismatch"})
+            self.state.count("PUT finish"); return self._send_json(200, {"uri": f"ssupload:?id={match.group(1)}"})
+        self._send_json(404, {"message": f"unknown endpoint {path}"})
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        match = re.fullmatch(r"/mock-video/([^/]+)\.mp4", path)
+        if match: return self._send_video()
+        if not self._authorized() or self._inject_failure(): return
+        match = re.fullmatch(r"/ent/v2/tasks/([^/]+)/creations", path)
+        if match:
+            self.state.count("GET creations"); task_id = match.group(1); state = self.state.task_state(task_id)
+            if state is None: return self._send_json(404, {"message": "task not found"})
+            creations = [{"id": task_id, "url": f"{self.base_url}/mock-video/{task_id}.mp4", "cover_url": f"{self.base_url}/mock-video/{task_id}.jpg"}] if state == "success" else []
+            return self._send_json(200, {"id": task_id, "state": state, "err_code": "", "creations": creations})
+        self._send_json(404, {"message": f"unknown endpoint {path}"})
+
+    def _send_video(self):
+        video, start, end = self.state.video, 0, len(self.state.video) - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if_range = (self.headers.get("If-Range") or "").strip('"')
+        partial = bool(match) and (not if_range or if_range == self.state.video_etag)
+        if partial: start, end = int(match.group(1)), min(int(match.group(2) or end), end)
+        self.state.count("GET video")
+        if partial and start > end:
+            # 起始位置超出文件末尾 (或区间为空) 时按 RFC 9110 返回 416, 用于检验下载端的续传处理
+            self.send_response(416); self.send_header("Content-Range", f"bytes */{len(video)}"); self.send_header("Content-Length", "0"); self.end_headers(); return
+        self.send_response(206 if partial else 200); self.send_header("Content-Type", "video/mp4"); self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{self.state.video_etag}"'); self.send_header("Content-Length", str(end - start + 1))
+        if partial: self.send_header("Content-Range", f"bytes {start}-{end}/{len(video)}")
+        self.end_headers()
+        # 按 bandwidth (字节/秒, 每个连接) 限速发送
+        step = max(self.state.bandwidth // 20, 64 << 10) if self.state.bandwidth else len(video)
+        for offset in range(start, end + 1, step):
+            chunk = video[offset:min(offset + step, end + 1)]
+            try: self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError): return
+            if self.state.bandwidth: time.sleep(len(chunk) / self.state.bandwidth)
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, **options):
+    # 在后台线程中启动, 返回 (server, base_url, state); port=0 时自动选择空闲端口
+    state = MockViduState(**options)
+    handler = type("BoundMockViduHandler", (MockViduHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler); server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-vidu-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}", state
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 Vidu API 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--render-delay", type=float, default=5.0, help="任务从 processing 到 success 的秒数")
+    parser.add_argument("--queue-delay", type=float, default=1.0, help="任务处于 queueing 状态的秒数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="API 请求返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="API 请求返回 429 的概率")
+    parser.add_argument("--bandwidth", type=int, default=0, help="每个下载连接的限速 (字节/秒), 0 为不限速")
+    parser.add_argument("--video-size", type=int, default=4 << 20, help="模拟视频的字节数")
+    args = parser.parse_args()
+    server, base_url, _ = start_mock_server(args.host, args.port, render_delay=args.render_delay, queue_delay=args.queue_delay, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, bandwidth=args.bandwidth, video_size=args.video_size)
+    print(f"模拟 Vidu API 已启动: {base_url} (在节点的 API地址 中填写该地址, Ctrl+C 退出)")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt: server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,92 +1,891 @@
 import os
 import time
 import json
-import requests
+import contextlib
 import io
-from PIL import Image
+
+import atexit
+import hashlib
+import heapq
+import itertools
+import random
+import re
+import sqlite3
+import threading
+import uuid
+import weakref
+from concurrent.futures import FIRST_EXCEPTION, CancelledError, Future, ThreadPoolExecutor, wait
 
 from comfy.comfy_types import IO
-from comfy_api.input_impl import VideoFromFile
+# requests / PIL / comfy_api.input_impl 在首次使用时才导入, 不拖慢 ComfyUI 启动
+
+NODE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(NODE_DIR, "cache")
+
+def video_from_file(path: str):
+    from comfy_api.input_impl import VideoFromFile
+    return VideoFromFile(path)
+
+# ======================================================================================
+# 磁盘缓存 (ViduUploadCache / ViduResultCache) - 相同图像不重复上传, 相同请求不重复生成
+# ======================================================================================
+class ViduDiskCache:
+    # 持久化到磁盘的 JSON 索引; 条目超过 ttl_seconds 过期, 超过容量时按 LRU 淘汰
+    # 命中只更新内存中的 last_used, 最多每 flush_interval 秒 (或下次写入/退出时) 落盘一次, 避免并发上传时反复重写索引
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int, flush_interval: float = 30.0):
+        self.path, self.ttl_seconds, self.max_entries, self.flush_interval = path, ttl_seconds, max_entries, flush_interval
+        self._lock, self._entries, self._dirty, self._saved_at = threading.Lock(), {}, False, time.monotonic()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError): self._entries = {}
+        atexit.register(self.flush)
+    def get_entry(self, key: str):
+        with self._lock:
+            entry, now = self._entries.get(key), time.time()
+            if not entry: return None
+            if now - entry.get("created", 0) > self.ttl_seconds: del self._entries[key]; self._dirty = True; return None
+            entry["last_used"], self._dirty = now, True
+            if time.monotonic() - self._saved_at >= self.flush_interval: self._save()
+            return dict(entry)
+    def flush(self):
+        with self._lock:
+            if self._dirty: self._save()
+    def configure(self, ttl_seconds: int, max_entries: int):
+        # 配置热加载后调整过期时间与容量, 已有条目保留, 超出的部分在下次写入时淘汰
+        with self._lock: self.ttl_seconds, self.max_entries = ttl_seconds, max_entries
+    def put_entry(self, key: str, **values):
+        with self._lock:
+            now = time.time(); self._entries[key] = {**values, "created": now, "last_used": now}
+            self._evict(now); self._save()
+    def invalidate(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None: self._save()
+    def _evict(self, now: float):
+        expired = [k for k, v in self._entries.items() if now - v.get("created", 0) > self.ttl_seconds]
+        for k in expired: del self._entries[k]
+        overflow = len(self._entries) - self.max_entries
+        if overflow > 0:
+            for k in sorted(self._entries, key=lambda k: self._entries[k].get("last_used", 0))[:overflow]: del self._entries[k]
+    def _save(self):
+        # 先写临时文件再替换, 避免进程中断时留下半截的缓存文件
+        os.makedirs(os.path.dirname(self.path), exist_ok=True); tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path); self._dirty, self._saved_at = False, time.monotonic()
+
+class ViduUploadCache(ViduDiskCache):
+    # 以张量内容哈希为键, 记录已上传得到的 uri
+    @staticmethod
+    def make_key(image_tensor, api_base: str, variant: str = "") -> str:
+        # variant 记录编码格式/目标分辨率等会改变上传内容的设置
+        frame = image_tensor[0].detach().cpu().contiguous().numpy()
+        digest = hashlib.sha256(f"{api_base}|{variant}|{frame.shape}|{frame.dtype}|".encode('utf-8')); digest.update(frame.tobytes())
+        return digest.hexdigest()
+    def get(self, key: str):
+        entry = self.get_entry(key); return entry.get("uri") if entry else None
+    def put(self, key: str, uri: str): self.put_entry(key, uri=uri)
+
+class ViduResultCache(ViduDiskCache):
+    # 以规范化后的请求体为键 (图片 URI 替换为图片内容哈希), 记录 task_id、封面链接和本地视频路径
+    @staticmethod
+    def make_key(api_base: str, endpoint: str, task_data: dict, image_digests: dict) -> str:
+        canonical = dict(task_data)
+        if "images" in canonical: canonical["images"] = [image_digests.get(uri, uri) for uri in canonical["images"]]
+        payload = json.dumps({"api_base": api_base, "endpoint": endpoint, "task_data": canonical}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    def get(self, key: str):
+        entry = self.get_entry(key)
+        if entry and not os.path.isfile(entry.get("local_path", "")): self.invalidate(key); return None
+        return entry
+    def put(self, key: str, task_id: str, cover_url: str, local_path: str): self.put_entry(key, task_id=task_id, cover_url=cover_url, local_path=os.path.abspath(local_path))
+
+_upload_cache, _upload_cache_lock = None, threading.Lock()
+def get_upload_cache(settings: dict = None):
+    # 进程内共享一个缓存实例; api.json 中可通过 "upload_cache": {"enabled", "ttl_seconds", "max_entries"} 配置
+    global _upload_cache
+    settings = settings or {}
+    if not settings.get("enabled", True): return None
+    ttl_seconds, max_entries = int(settings.get("ttl_seconds", 12 * 3600)), int(settings.get("max_entries", 2000))
+    with _upload_cache_lock:
+        if _upload_cache is None: _upload_cache = ViduUploadCache(os.path.join(CACHE_DIR, "upload_cache.json"), ttl_seconds, max_entries)
+        elif (_upload_cache.ttl_seconds, _upload_cache.max_entries) != (ttl_seconds, max_entries): _upload_cache.configure(ttl_seconds, max_entries)
+        return _upload_cache
+
+# 进行中的上传 {上传缓存键: Future}; 并发的相同上传 (同一张图片、同一个 Key) 只执行一次
+_upload_flights, _upload_flights_lock = {}, threading.Lock()
+
+_result_cache, _result_cache_lock = None, threading.Lock()
+def get_result_cache(settings: dict = None):
+    # api.json 中可通过 "result_cache": {"enabled", "max_age_seconds", "max_entries"} 配置
+    global _result_cache
+    settings = settings or {}
+    if not settings.get("enabled", True): return None
+    ttl_seconds, max_entries = int(settings.get("max_age_seconds", 7 * 24 * 3600)), int(settings.get("max_entries", 500))
+    with _result_cache_lock:
+        if _result_cache is None: _result_cache = ViduResultCache(os.path.join(CACHE_DIR, "result_cache.json"), ttl_seconds, max_entries)
+        elif (_result_cache.ttl_seconds, _result_cache.max_entries) != (ttl_seconds, max_entries): _result_cache.configure(ttl_seconds, max_entries)
+        return _result_cache
+
+# ======================================================================================
+# 图片编码 (encode_image) - 上传前的格式转换与缩放
+# ======================================================================================
+DEFAULT_UPLOAD_SETTINGS = {"max_workers": 4, "format": "png", "png_compress_level": 6, "quality": 95, "downscale": False}
+UPLOAD_FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+RESOLUTION_SHORT_SIDE = {"360p": 360, "540p": 540, "720p": 720, "1080p": 1080}
+ENCODE_ROWS_PER_CHUNK = 64
+
+def encode_settings_key(settings: dict, resolution: str = None) -> str:
+    fmt = str(settings["format"]).lower(); target = RESOLUTION_SHORT_SIDE.get(resolution) if settings.get("downscale") else None
+    level = settings["png_compress_level"] if fmt == "png" else settings["quality"]
+    return f"{fmt}:{level}:{target or 'orig'}"
+
+def encode_image(image_tensor, settings: dict, resolution: str = None):
+    # 返回 (BytesIO, content_type); BytesIO 直接作为请求体上传, 不再额外 getvalue() 复制一份
+    fmt = str(settings["format"]).lower()
+    if fmt not in UPLOAD_FORMATS: raise ValueError(f"不支持的上传图片格式: {fmt}, 可选: {', '.join(UPLOAD_FORMATS)}")
+    import torch
+    from PIL import Image
+    # 按行分块换算到预先分配的 uint8 输出中, float 中间结果只占一个分块, 不生成整帧的 float 副本
+    source = image_tensor[0]; frame = torch.empty(tuple(source.shape), dtype=torch.uint8)
+    for row in range(0, source.shape[0], ENCODE_ROWS_PER_CHUNK): frame[row:row + ENCODE_ROWS_PER_CHUNK].copy_(source[row:row + ENCODE_ROWS_PER_CHUNK].mul(255).clamp_(0, 255))
+    frame = frame.numpy()
+    pil_image = Image.fromarray(frame[..., 0] if frame.shape[-1] == 1 else frame)
+    target = RESOLUTION_SHORT_SIDE.get(resolution) if settings.get("downscale") else None
+    if target and min(pil_image.size) > target:
+        # 接口最终只按 360p/720p/1080p 渲染, 短边超过目标分辨率的部分只会增加编码和上传的开销
+        scale = target / min(pil_image.size)
+        pil_image = pil_image.resize((max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale))), Image.LANCZOS, reducing_gap=3.0)
+    pil_format, content_type = UPLOAD_FORMATS[fmt]
+    if fmt == "jpeg" and pil_image.mode not in ("RGB", "L"): pil_image = pil_image.convert("RGB")  # JPEG 不支持透明通道
+    if fmt == "png": save_kwargs = {"compress_level": int(settings["png_compress_level"])}
+    elif fmt == "jpeg": save_kwargs = {"quality": int(settings["quality"]), "subsampling": 0}
+    else: save_kwargs = {"quality": int(settings["quality"]), "method": 4}
+    buffer = io.BytesIO(); pil_image.save(buffer, format=pil_format, **save_kwargs); buffer.seek(0)
+    return buffer, content_type
+
+# ======================================================================================
+# 共享HTTP连接池 (ViduHTTPClient) - 所有节点共用连接、超时与重试策略
+# ======================================================================================
+DEFAULT_HTTP_SETTINGS = {"pool_size": 32, "connect_timeout": 10, "read_timeout": 60, "max_retries": 3, "backoff_base": 0.5, "backoff_max": 30, "max_rate_limit_retries": 20}
+DEFAULT_DOWNLOAD_SETTINGS = {"chunk_size": 1 << 20, "max_retries": 5, "segments": 4, "segment_threshold": 32 << 20}
+IDEMPOTENT_METHODS, RETRY_STATUS_CODES = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}), frozenset({429, 500, 502, 503, 504})
+KEY_POOL_RETRY_STATUS_CODES = RETRY_STATUS_CODES - {429}  # 经过 ViduKeyPool 的请求: 每个 429 都交给 Key 级退让处理
+
+class ViduAPIError(Exception):
+    # Vidu API 返回非 200 状态码; 调用方可按 status_code 区分请求被拒绝 (4xx) 与服务端/网络问题
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message); self.status_code = status_code
+
+class ViduHTTPClient:
+    # 进程内共享的 requests.Session; 幂等请求在 429/5xx/连接错误时按带抖动的指数退避重试
+    def __init__(self, settings: dict):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.settings = settings
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=int(settings["pool_size"]), max_retries=0)
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter); weakref.finalize(self, self.session.close)
+        self._lock, self._counters = threading.Lock(), {"requests": 0, "retries": 0, "errors": 0}
+    def _count(self, name: str, value: int = 1):
+        with self._lock: self._counters[name] += value
+    def retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try: return min(float(retry_after), float(self.settings["backoff_max"]))
+            except ValueError: pass
+        delay = min(float(self.settings["backoff_max"]), float(self.settings["backoff_base"]) * (2 ** attempt))
+        return random.uniform(0, delay)  # full jitter, 避免大量轮询在同一时刻重试
+    def request(self, method: str, url: str, timeout=None, retries: int = None, retry_statuses=RETRY_STATUS_CODES, **kwargs):
+        import requests
+        method = method.upper()
+        if retries is None: retries = int(self.settings["max_retries"]) if method in IDEMPOTENT_METHODS else 0
+        if timeout is None: timeout = (float(self.settings["connect_timeout"]), float(self.settings["read_timeout"]))
+        for attempt in range(retries + 1):
+            body = kwargs.get("data")
+            if hasattr(body, "seek"): body.seek(0)
+            self._count("requests")
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._count("errors")
+                if attempt >= retries: raise
+                delay = self.retry_delay(attempt)
+            else:
+                if response.status_code not in retry_statuses or attempt >= retries: response.attempts = attempt + 1; return response
+                delay = self.retry_delay(attempt, response); response.close()
+            self._count("retries"); time.sleep(delay)
+    def stats(self) -> dict:
+        # num_connections 为新建连接数, num_requests 为经过连接池的请求数, 两者之差即连接复用次数
+        connections = pool_requests = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is None: continue
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None: continue
+                connections += pool.num_connections; pool_requests += pool.num_requests
+        with self._lock: counters = dict(self._counters)
+        counters.update({"pool_connections_created": connections, "pool_requests": pool_requests, "pool_hits": max(pool_requests - connections, 0)})
+        return counters
+
+_http_client, _http_client_lock = None, threading.Lock()
+def get_http_client(settings: dict = None) -> ViduHTTPClient:
+    # api.json 中可通过 "http": {...} 覆盖 DEFAULT_HTTP_SETTINGS; 配置变化时重建连接池
+    global _http_client
+    merged = {**DEFAULT_HTTP_SETTINGS, **(settings or {})}
+    with _http_client_lock:
+        if _http_client is None or (settings is not None and _http_client.settings != merged):
+            # 旧连接池不立即关闭: 仍在使用它的请求 (包括流式下载) 继续完成, 旧实例不再被引用时再关闭其 Session
+            _http_client = ViduHTTPClient(merged)
+        return _http_client
+
+# ======================================================================================
+# API Key 池 (ViduKeyPool) - 多账户并发上限、令牌桶限速与 429 退让
+# ======================================================================================
+def api_key_specs(config: dict) -> list:
+    # api.json 中 "api_keys" 可以是字符串列表, 或 {"key", "max_concurrency", "rate_per_second", "burst"} 列表; 旧的 "api_key" 仍然有效
+    specs = [{"key": item} if isinstance(item, str) else dict(item) for item in config.get("api_keys") or []]
+    if config.get("api_key") and all(spec.get("key") != config["api_key"] for spec in specs): specs.insert(0, {"key": config["api_key"]})
+    return [spec for spec in specs if spec.get("key")]
+
+class ViduKeyPool:
+    # 每个 Key 有独立的并发任务上限 (max_concurrency, 0 为不限) 和请求速率令牌桶 (rate_per_second, 0 为不限);
+    # 新任务选择负载最低的 Key, 之后该任务的上传、轮询与取消都固定使用同一个 Key. 日志中只出现 key_id (Key 的哈希前缀)
+    def __init__(self):
+        self._cond, self._keys, self._active = threading.Condition(), {}, []
+    @staticmethod
+    def key_id(key: str) -> str: return hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+    def configure(self, specs: list):
+        with self._cond:
+            active, now = [], time.monotonic()
+            for spec in specs:
+                kid, rate = self.key_id(spec["key"]), float(spec.get("rate_per_second", 0))
+                state = self._keys.setdefault(kid, {"key": spec["key"], "in_flight": 0, "updated": now, "blocked_until": 0.0})
+                state.update(max_concurrency=int(spec.get("max_concurrency", 0)), rate=rate, burst=float(spec.get("burst", max(1.0, rate))))
+                if "tokens" not in state: state["tokens"] = state["burst"]
+                if kid not in active: active.append(kid)
+            # 已从配置中移除的 Key 在其进行中的任务结束前保留状态, 但不再分配新任务
+            for kid in [k for k in self._keys if k not in active and self._keys[k]["in_flight"] == 0]: del self._keys[kid]
+            self._active = active; self._cond.notify_all()
+    def key(self, key_id: str) -> str:
+        with self._cond: return self._keys[key_id]["key"]
+    def has(self, key_id: str) -> bool:
+        with self._cond: return key_id in self._keys
+    def _load(self, state: dict) -> float: return state["in_flight"] / state["max_concurrency"] if state["max_concurrency"] else 0.0
+    def _rank(self, kid: str, now: float):
+        state = self._keys[kid]; return (state["blocked_until"] > now, self._load(state), state["in_flight"])
+    def pick(self) -> str:
+        # 只选择不占用名额, 用于任务创建之前的上传等请求
+        with self._cond:
+            if not self._active: raise ValueError("api.json 中没有可用的 API Key。")
+            now = time.monotonic(); return min(self._active, key=lambda kid: self._rank(kid, now))
+    def lease(self, preferred: str = None, log=None) -> str:
+        # 占用一个并发名额; 所有候选 Key 都已满时排队等待, 不直接失败
+        with self._cond:
+            waiting = False
+            while True:
+                candidates = [preferred] if preferred in self._keys else list(self._active)
+                if not candidates: raise ValueError("api.json 中没有可用的 API Key。")
+                available = [kid for kid in candidates if not self._keys[kid]["max_concurrency"] or self._keys[kid]["in_flight"] < self._keys[kid]["max_concurrency"]]
+                if available:
+                    now = time.monotonic(); kid = min(available, key=lambda k: self._rank(k, now)); self._keys[kid]["in_flight"] += 1; return kid
+                if log and not waiting: log("API Key 进行中的任务数已达上限, 排队等待空闲名额..."); waiting = True
+                self._cond.wait()
+    def acquire(self, key_id: str):
+        # 恢复的任务已经在服务器上运行: 直接计入并发名额, 不排队; 之后提交的新任务照常受 max_concurrency 限制
+        with self._cond:
+            if key_id in self._keys: self._keys[key_id]["in_flight"] += 1
+    def release(self, key_id: str):
+        with self._cond:
+            if key_id in self._keys: self._keys[key_id]["in_flight"] = max(0, self._keys[key_id]["in_flight"] - 1)
+            self._cond.notify_all()
+    def reserve(self, key_id: str) -> float:
+        # 不阻塞: 取得令牌时返回 0, 否则返回还需等待的秒数 (429 退让期或令牌桶为空)
+        with self._cond:
+            state, now = self._keys.get(key_id), time.monotonic()
+            if state is None: return 0.0
+            if state["blocked_until"] > now: return state["blocked_until"] - now
+            if state["rate"] <= 0: return 0.0
+            state["tokens"], state["updated"] = min(state["burst"], state["tokens"] + (now - state["updated"]) * state["rate"]), now
+            if state["tokens"] >= 1: state["tokens"] -= 1; return 0.0
+            return (1 - state["tokens"]) / state["rate"]
+    def throttle(self, key_id: str):
+        # 发送请求前调用: 等待令牌桶中有可用令牌, 且该 Key 不处于 429 退让期
+        while True:
+            delay = self.reserve(key_id)
+            if delay <= 0: return
+            time.sleep(delay)
+    def penalize(self, key_id: str, seconds: float):
+        with self._cond:
+            if key_id in self._keys: self._keys[key_id]["blocked_until"] = max(self._keys[key_id]["blocked_until"], time.monotonic() + seconds)
+    def snapshot(self) -> list:
+        with self._cond: return [{"key_id": kid, "in_flight": self._keys[kid]["in_flight"], "max_concurrency": self._keys[kid]["max_concurrency"]} for kid in self._active]
+
+class ViduRateLimited(Exception):
+    # 不等待的请求 (轮询) 遇到 Key 限流时抛出, delay 为该 Key 恢复前还需等待的秒数
+    def __init__(self, key_id: str, delay: float):
+        super().__init__(f"Key {key_id} 被限流, {delay:.1f} 秒后重试"); self.key_id, self.delay = key_id, delay
+
+_key_pool = ViduKeyPool()
+def get_key_pool() -> ViduKeyPool: return _key_pool
+
+# ======================================================================================
+# 配置 (ViduConfig) - 进程内只解析一次 api.json, 文件修改后自动重新加载
+# ======================================================================================
+class ViduConfig:
+    # 最多每 check_interval 秒检查一次文件修改时间; 内容变化时重新解析并更新 API Key 池, 无需重启 ComfyUI
+    # 重新加载失败 (文件写到一半、被删除等) 时继续使用上一次成功加载的配置, 不影响进行中的任务; 文件再次变化时重试
+    def __init__(self, check_interval: float = 2.0):
+        self.check_interval, self._lock = check_interval, threading.Lock()
+        self._data, self._path, self._mtime, self._checked_at, self._failed = None, None, None, 0.0, None
+    @staticmethod
+    def path() -> str:
+        # VIDU_API_CONFIG 可指向其他配置文件 (例如基准测试连接本地模拟服务时)
+        return os.environ.get("VIDU_API_CONFIG") or os.path.join(NODE_DIR, 'api.json')
+    def _fresh(self, now: float) -> bool: return self._data is not None and now - self._checked_at < self.check_interval
+    def _read(self, path: str) -> dict:
+        try:
+            with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
+        except FileNotFoundError: print(f"[Vidu::Config] 错误: 未找到 {path} 文件！"); raise FileNotFoundError(f"请在 {NODE_DIR} 目录下创建 api.json 文件。")
+        except json.JSONDecodeError: print("[Vidu::Config] 错误: api.json 文件格式不正确，无法解析。"); raise ValueError("api.json 文件不是一个有效的JSON。")
+        if not api_key_specs(data): raise ValueError("在 api.json 中找到了文件，但未找到 'api_key' 或 'api_keys' 字段。")
+        return data
+    def load(self) -> dict:
+        now = time.monotonic()
+        if self._fresh(now): return self._data
+        with self._lock:
+            if self._fresh(now): return self._data
+            path = self.path()
+            try: mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError: mtime = None
+            if (self._data is None or (path, mtime) != (self._path, self._mtime)) and (self._data is None or (path, mtime) != self._failed):
+                print(f"[Vidu::Config] 正在从 {path} 加载配置...")
+                try: data = self._read(path)
+                except (FileNotFoundError, ValueError) as e:
+                    if self._data is None: raise
+                    self._failed = (path, mtime); print(f"[Vidu::Config] 重新加载失败, 继续使用上一次成功加载的配置: {e}")
+                else:
+                    specs = api_key_specs(data); _key_pool.configure(specs)
+                    print(f"[Vidu::Config] 配置{'重新' if self._data is not None else ''}加载成功, 共 {len(specs)} 个 API Key。")
+                    self._data, self._path, self._mtime, self._failed = data, path, mtime, None
+            self._checked_at = now
+            return self._data
+
+_config = ViduConfig()
+def get_config() -> dict: return _config.load()
+
+# ======================================================================================
+# 任务调度器 (ViduTaskScheduler) - 集中轮询所有进行中的任务
+# ======================================================================================
+DEFAULT_SCHEDULER_SETTINGS = {"poll_initial": 2, "poll_max": 15, "poll_backoff": 1.5, "poll_workers": 8, "max_poll_errors": 3}
+
+class ViduTaskScheduler:
+    # 单个后台线程持有所有进行中的 task_id, 按各自的下次轮询时间出堆, 查询请求交给小线程池执行;
+    # 轮询间隔从 poll_initial 开始按 poll_backoff 递增到 poll_max, 结果通过 Future 通知等待方
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self._cond, self._tasks, self._heap, self._seq = threading.Condition(), {}, [], itertools.count()
+        self._on_finish = {}
+        self._pool = ThreadPoolExecutor(max_workers=int(settings["poll_workers"]), thread_name_prefix="vidu-poll")
+        self._thread = threading.Thread(target=self._run, name="vidu-task-scheduler", daemon=True); self._thread.start()
+    def bind_release(self, task_id: str, callback) -> bool:
+        # 任务结束 (成功/失败/超时/取消) 时调用 callback, 用于归还 API Key 的并发名额; 任务已绑定过时返回 False
+        with self._cond:
+            if task_id in self._on_finish: return False
+            self._on_finish[task_id] = callback; return True
+    def unbind_release(self, task_id: str, callback):
+        # 任务没有进入轮询就结束时 (例如已下载过), 立即调用尚未触发的 callback
+        with self._cond:
+            if task_id in self._tasks or self._on_finish.get(task_id) is not callback: return
+            del self._on_finish[task_id]
+        callback()
+    def watch(self, task_id: str, poll, timeout: int = 3600) -> Future:
+        with self._cond:
+            if task_id in self._tasks: return self._tasks[task_id]["future"]
+            now, future = time.monotonic(), Future()
+            self._tasks[task_id] = {"poll": poll, "future": future, "deadline": now + timeout, "timeout": timeout, "interval": float(self.settings["poll_initial"]), "errors": 0}
+            heapq.heappush(self._heap, (now, next(self._seq), task_id)); self._cond.notify()
+        return future
+    def forget(self, task_id: str):
+        self._finish(task_id, error=CancelledError(f"任务 {task_id} 已停止轮询"))
+    def configure(self, settings: dict):
+        # 配置热加载: 轮询间隔等立即生效; poll_workers 变化时换用新线程池, 旧线程池执行完已提交的轮询后退出
+        with self._cond:
+            resize, self.settings = int(settings["poll_workers"]) != int(self.settings["poll_workers"]), settings
+            if resize: old, self._pool = self._pool, ThreadPoolExecutor(max_workers=int(settings["poll_workers"]), thread_name_prefix="vidu-poll"); old.shutdown(wait=False)
+    def in_flight(self) -> list:
+        with self._cond: return list(self._tasks)
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(timeout=(self._heap[0][0] - time.monotonic()) if self._heap else None)
+                _, _, task_id = heapq.heappop(self._heap); entry = self._tasks.get(task_id)
+                if entry is not None: self._pool.submit(self._poll_once, task_id, entry)
+    def _poll_once(self, task_id: str, entry: dict):
+        if time.monotonic() >= entry["deadline"]: self._finish(task_id, error=TimeoutError(f"任务轮询超时（超过 {entry['timeout']} 秒）")); return
+        try: status_data = entry["poll"]()
+        except ViduRateLimited as e: self._schedule(task_id, entry, min(e.delay, max(0.0, entry["deadline"] - time.monotonic()))); return  # Key 限流: 到其退让结束再轮询, 不计入错误次数
+        except Exception as e:
+            entry["errors"] += 1
+            if entry["errors"] > int(self.settings["max_poll_errors"]): self._finish(task_id, error=e)
+            else: self._schedule(task_id, entry)
+            return
+        entry["errors"], state = 0, status_data.get("state")
+        if state == "success": self._finish(task_id, result=status_data)
+        elif state == "failed": self._finish(task_id, error=Exception(f"任务生成失败，错误码: {status_data.get('err_code', 'N/A')}"))
+        else:
+            entry["interval"] = min(float(self.settings["poll_max"]), entry["interval"] * float(self.settings["poll_backoff"])); self._schedule(task_id, entry)
+    def _schedule(self, task_id: str, entry: dict, delay: float = None):
+        with self._cond:
+            if self._tasks.get(task_id) is entry: heapq.heappush(self._heap, (time.monotonic() + (entry["interval"] if delay is None else delay), next(self._seq), task_id)); self._cond.notify()
+    def _finish(self, task_id: str, result=None, error=None):
+        with self._cond: entry, callback = self._tasks.pop(task_id, None), self._on_finish.pop(task_id, None)
+        if callback: callback()
+        if entry is None or entry["future"].done(): return
+        if error is not None: entry["future"].set_exception(error)
+        else: entry["future"].set_result(result)
+
+_task_scheduler, _task_scheduler_lock = None, threading.Lock()
+def get_task_scheduler(settings: dict = None) -> ViduTaskScheduler:
+    # api.json 中可通过 "scheduler": {...} 覆盖 DEFAULT_SCHEDULER_SETTINGS
+    global _task_scheduler
+    with _task_scheduler_lock:
+        if _task_scheduler is None: _task_scheduler = ViduTaskScheduler({**DEFAULT_SCHEDULER_SETTINGS, **(settings or {})})
+        elif settings is not None and _task_scheduler.settings != {**DEFAULT_SCHEDULER_SETTINGS, **settings}: _task_scheduler.configure({**DEFAULT_SCHEDULER_SETTINGS, **settings})
+        return _task_scheduler
+
+# ======================================================================================
+# 指标 (ViduMetrics) - 各阶段耗时直方图与计数器, 以 Prometheus 文本格式导出
+# ======================================================================================
+class ViduMetrics:
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+    def __init__(self):
+        self._lock, self._counters, self._histograms = threading.Lock(), {}, {}
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + value
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self._histograms.get(key, ([0] * len(self.BUCKETS), 0.0, 0))
+            self._histograms[key] = ([n + (value <= b) for n, b in zip(buckets, self.BUCKETS)], total + value, count + 1)
+    @staticmethod
+    def _labels(labels, **extra) -> str:
+        items = list(labels) + list(extra.items())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+    def render(self, extra_counters: dict = None) -> str:
+        with self._lock: counters, histograms = dict(self._counters), dict(self._histograms)
+        for name, value in (extra_counters or {}).items(): counters[(name, ())] = value
+        lines, typed = [], set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed: lines.append(f"# TYPE {name} counter"); typed.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            if name not in typed: lines.append(f"# TYPE {name} histogram"); typed.add(name)
+            lines.extend(f"{name}_bucket{self._labels(labels, le=b)} {n}" for b, n in zip(self.BUCKETS, buckets))
+            lines.extend([f"{name}_bucket{self._labels(labels, le='+Inf')} {count}", f"{name}_sum{self._labels(labels)} {total}", f"{name}_count{self._labels(labels)} {count}"])
+        return "\n".join(lines) + "\n"
+
+_metrics = ViduMetrics()
+def get_metrics() -> ViduMetrics: return _metrics
+
+def render_metrics() -> str:
+    # HTTP 连接池的计数器在导出时读取, 不在每次请求时重复记录
+    extra = {f"vidu_http_{k}_total": v for k, v in _http_client.stats().items()} if _http_client is not None else {}
+    return _metrics.render(extra)
+
+def register_metrics_route():
+    # 在 ComfyUI 服务上挂载 GET /vidu/metrics; 不在 ComfyUI 中运行 (例如基准脚本) 时静默跳过
+    try:
+        from aiohttp import web
+        from server import PromptServer
+    except ImportError: return
+    @PromptServer.instance.routes.get("/vidu/metrics")
+    async def vidu_metrics(request): return web.Response(text=render_metrics(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+# ======================================================================================
+# 任务日志 (ViduTaskJournal) - 记录已提交的任务, 重启后继续轮询与下载
+# ======================================================================================
+class ViduTaskJournal:
+    # SQLite (WAL) 存储: tasks 表保存每个任务的最新状态, events 表只追加状态变化记录; 不保存 API Key
+    TERMINAL_STATES = frozenset({"downloaded", "failed", "cancelled"})
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path, self._lock, self._task_locks = path, threading.Lock(), {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, node TEXT, api_base TEXT, endpoint TEXT, payload TEXT, state TEXT, output_path TEXT, file_prefix TEXT, video_url TEXT, cover_url TEXT, local_path TEXT, error TEXT, created_at REAL, updated_at REAL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT, state TEXT, detail TEXT, ts REAL)")
+            if "key_id" not in [row["name"] for row in self._conn.execute("PRAGMA table_info(tasks)")]: self._conn.execute("ALTER TABLE tasks ADD COLUMN key_id TEXT")
+    def task_lock(self, task_id: str) -> threading.Lock:
+        # 同一任务在进程内只允许一个线程执行等待+下载 (启动恢复与恢复节点可能同时处理同一任务)
+        with self._lock: return self._task_locks.setdefault(task_id, threading.Lock())
+    def record_submit(self, task_id: str, node: str, api_base: str, endpoint: str, payload: dict, output_path: str, file_prefix: str, key_id: str = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO tasks (task_id, node, api_base, endpoint, payload, state, output_path, file_prefix, key_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'submitted', ?, ?, ?, ?, ?)", (task_id, node, api_base, endpoint, json.dumps(payload, ensure_ascii=False), output_path, file_prefix, key_id, now, now))
+            self._conn.execute("INSERT INTO events (task_id, state, detail, ts) VALUES (?, 'submitted', NULL, ?)", (task_id, now))
+    def record_state(self, task_id: str, state: str, **fields):
+        # fields 可包含 video_url / cover_url / local_path / error; 状态未变化且无新字段时不写入
+        allowed = {k: v for k, v in fields.items() if k in ("api_base", "key_id", "output_path", "file_prefix", "video_url", "cover_url", "local_path", "error")}
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None: self._conn.execute("INSERT INTO tasks (task_id, state, created_at, updated_at) VALUES (?, ?, ?, ?)", (task_id, state, now, now))
+            elif row["state"] == state and not allowed: return
+            assignments = ", ".join(f"{k} = ?" for k in allowed)
+            self._conn.execute(f"UPDATE tasks SET state = ?, updated_at = ?{', ' + assignments if assignments else ''} WHERE task_id = ?", (state, now, *allowed.values(), task_id))
+            self._conn.execute("INSERT INTO events (task_id, state, detail, ts) VALUES (?, ?, ?, ?)", (task_id, state, allowed.get("error"), now))
+    def get(self, task_id: str):
+        with self._lock: row = self._conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+    def recent(self, limit: int = 50) -> list:
+        with self._lock: rows = self._conn.execute("SELECT * FROM tasks ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+    def unfinished(self, max_age_seconds: float) -> list:
+        placeholders = ", ".join("?" for _ in self.TERMINAL_STATES)
+        with self._lock: rows = self._conn.execute(f"SELECT * FROM tasks WHERE state NOT IN ({placeholders}) AND created_at >= ? ORDER BY created_at", (*self.TERMINAL_STATES, time.time() - max_age_seconds)).fetchall()
+        return [dict(r) for r in rows]
+
+_task_journal, _task_journal_lock = None, threading.Lock()
+def get_task_journal(settings: dict = None):
+    # api.json 中可通过 "journal": {"enabled", "resume_on_startup", "resume_max_age_seconds"} 配置
+    global _task_journal
+    settings = settings or {}
+    if not settings.get("enabled", True): return None
+    with _task_journal_lock:
+        if _task_journal is None: _task_journal = ViduTaskJournal(os.path.join(CACHE_DIR, "task_journal.sqlite3"))
+        return _task_journal
 
 # ======================================================================================
 # 基础类 (ViduBaseNode) - 无需改动
 # ======================================================================================
 class ViduBaseNode:
     def __init__(self):
-        self.api_base = None; self.token = None; self.node_name = self.__class__.__name__; self._load_api_key()
+        self.api_base = None; self.token = None; self._key_id = None; self._image_digests = {}; self._upload_keys = {}; self._deferred, self._digest_memo = None, {}; self.node_name = self.__class__.__name__
+        self._trace_lock, self._trace_task_id, self._trace_buffer = threading.Lock(), None, []; self._load_api_key()
     def log(self, message: str): print(f"[Vidu::{self.node_name}] {message}")
+    @contextlib.contextmanager
+    def _span(self, stage: str, **attrs):
+        # 记录一个阶段的耗时; 调用方可以往 yield 出来的 dict 中补充 bytes / retries 等字段
+        started_at, start, outcome = time.time(), time.perf_counter(), "ok"
+        try: yield attrs
+        except ViduRateLimited: outcome = "rate_limited"; raise
+        except BaseException: outcome = "error"; raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _metrics.observe("vidu_stage_duration_seconds", elapsed, stage=stage); _metrics.inc("vidu_stage_total", stage=stage, outcome=outcome)
+            if attrs.get("bytes"): _metrics.inc("vidu_transfer_bytes_total", attrs["bytes"], stage=stage)
+            if attrs.get("retries"): _metrics.inc("vidu_retries_total", attrs["retries"], stage=stage)
+            self._trace({"stage": stage, "outcome": outcome, "start": round(started_at, 3), "duration_ms": round(elapsed * 1000, 1), **attrs})
+    def _trace(self, record: dict = None):
+        # api.json 中设置 "metrics": {"trace_dir": "..."} 后, 每个任务的阶段记录写入 <trace_dir>/<task_id>.jsonl;
+        # 任务创建之前的阶段 (上传等) 先缓存在内存中, 拿到 task_id 后一起写入
+        trace_dir = self.config.get("metrics", {}).get("trace_dir")
+        if not trace_dir: return
+        with self._trace_lock:
+            if record is not None: self._trace_buffer.append(record)
+            if self._trace_task_id is None or not self._trace_buffer: return
+            records, self._trace_buffer, path = self._trace_buffer, [], os.path.join(trace_dir, f"{self._trace_task_id}.jsonl")
+            os.makedirs(trace_dir, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f: f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    @contextlib.contextmanager
+    def _traced(self, task_id: str):
+        with self._trace_lock: self._trace_task_id = task_id
+        self._trace()
+        try: yield
+        finally: self._reset_trace()
+    def _reset_trace(self):
+        # 丢弃尚未写入的阶段记录; 每次运行开始与结束时调用, 上一次运行 (命中缓存/推荐提示词等没有 task_id 的情况) 的记录不会混入下一个任务
+        with self._trace_lock: self._trace_task_id, self._trace_buffer = None, []
+    def _use_key(self, key_id: str): self._key_id, self.token = key_id, _key_pool.key(key_id)
+    def _pin_key(self):
+        # 尚未固定 Key 时选择当前负载最低的 Key, 之后本次任务的所有 API 请求都使用它
+        if self._key_id is None or not _key_pool.has(self._key_id): self._use_key(_key_pool.pick())
+        return self._key_id
+    @property
+    def upload_settings(self) -> dict: return {**DEFAULT_UPLOAD_SETTINGS, **self.config.get("upload", {})}
+    @property
+    def http(self) -> ViduHTTPClient: return get_http_client(self.config.get("http"))
+    @property
+    def config(self) -> dict: return get_config()
     def _load_api_key(self):
-        try:
-            node_dir, config_path = os.path.dirname(os.path.abspath(__file__)), os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api.json')
-            self.log(f"正在从 {config_path} 加载API Key...")
-            with open(config_path, 'r', encoding='utf-8') as f: config = json.load(f); self.token = config.get("api_key")
-            if not self.token: raise ValueError("在 api.json 中找到了文件，但未找到 'api_key' 字段。")
-            self.log("API Key 加载成功！")
-        except FileNotFoundError: self.log("错误: 未找到 api.json 文件！"); raise FileNotFoundError(f"请在 {os.path.dirname(os.path.abspath(__file__))} 目录下创建 api.json 文件。")
-        except json.JSONDecodeError: self.log("错误: api.json 文件格式不正确，无法解析。"); raise ValueError("api.json 文件不是一个有效的JSON。")
-    def _make_request(self, method: str, endpoint: str, data: dict = None):
+        # 配置由 ViduConfig 在进程内统一解析并缓存, 构造节点时不再重复读取文件
+        self.token = api_key_specs(self.config)[0]["key"]
+    def _make_request(self, method: str, endpoint: str, data: dict = None, stage: str = "api", wait: bool = True):
+        # wait=False (调度器中的轮询): Key 处于限流期或收到 429 时不占用线程等待, 抛出 ViduRateLimited 由调度器推迟该任务
+        import requests
         if not self.token: self._load_api_key()
         if not self.api_base: raise ValueError("API 地址 (api_base) 未在节点中配置")
+        key_id = self._pin_key()
         headers, url = {"Content-Type": "application/json", "Authorization": f"Token {self.token}"}, f"{self.api_base}{endpoint}"
         self.log(f"发送 {method} 请求到: {url}")
         if data: self.log(f"请求数据: {json.dumps(data, ensure_ascii=False)[:500]}...")
         try:
-            response = requests.request(method, url, json=data, headers=headers)
+            with self._span(stage) as span:
+                for attempt in itertools.count():
+                    if wait: _key_pool.throttle(key_id)
+                    elif (delay := _key_pool.reserve(key_id)) > 0: raise ViduRateLimited(key_id, delay)
+                    response = self.http.request(method, url, json=data, headers=headers, retry_statuses=KEY_POOL_RETRY_STATUS_CODES)
+                    # 429 表示请求未被处理: 该 Key 按 Retry-After 退让后重新排队, 不直接判定失败
+                    if response.status_code != 429 or attempt >= int(self.http.settings["max_rate_limit_retries"]): break
+                    delay = self.http.retry_delay(min(attempt, 6), response); _key_pool.penalize(key_id, delay)
+                    self.log(f"请求被限流 (429), Key {key_id} 退让 {delay:.1f} 秒后重试..."); _metrics.inc("vidu_rate_limited_total", key_id=key_id)
+                    if not wait: raise ViduRateLimited(key_id, delay)
+                span["retries"] = getattr(response, "attempts", 1) - 1 + attempt
             self.log(f"响应状态码: {response.status_code}")
-            if response.status_code != 200: self.log(f"API请求失败: {response.text}"); raise Exception(f"API请求失败 (状态码 {response.status_code}): {response.text}")
+            if response.status_code != 200: self.log(f"API请求失败: {response.text}"); raise ViduAPIError(f"API请求失败 (状态码 {response.status_code}): {response.text}", response.status_code)
             return response.json()
         except requests.RequestException as e: self.log(f"网络请求异常: {e}"); raise Exception(f"网络请求失败: {e}")
-    def _upload_image(self, image_tensor) -> str:
+    def _content_digest(self, image_tensor, upload_settings: dict, resolution: str = None) -> str:
+        # 图片内容 + 编码设置的哈希, 与账户无关; 同一次运行中对同一张量只计算一次
+        memo_key = (id(image_tensor), self.api_base, encode_settings_key(upload_settings, resolution))
+        if memo_key not in self._digest_memo: self._digest_memo[memo_key] = ViduUploadCache.make_key(image_tensor, self.api_base, memo_key[2])
+        return self._digest_memo[memo_key]
+    def _upload_key(self, image_tensor, upload_settings: dict, resolution: str = None):
+        # 返回 (内容哈希, 上传缓存键): 内容哈希用于结果缓存; 上传缓存键再加上 key_id, 因为图片URI与上传它的账户绑定
+        digest = self._content_digest(image_tensor, upload_settings, resolution)
+        return digest, hashlib.sha256(f"{digest}|{self._pin_key()}".encode('utf-8')).hexdigest()
+    def _defer_upload(self, image_tensor, resolution: str = None, label: str = "图片") -> str:
+        # 生成节点先用内容哈希占位构造请求, 结果缓存未命中时再由 _resolve_uploads 真正上传
+        digest = self._content_digest(image_tensor, self.upload_settings, resolution); uri = f"vidu-pending://{digest}"
+        self._image_digests[uri] = digest; self._deferred.setdefault(uri, (image_tensor, resolution, label)); return uri
+    def _resolve_uploads(self, task_data: dict, pending: dict) -> dict:
+        uris = list(dict.fromkeys(uri for uri in task_data.get("images") or [] if uri in pending))
+        if not uris: return task_data
+        items = [pending[uri] for uri in uris]
+        uploaded = dict(zip(uris, self._upload_images([t for t, _, _ in items], [label for _, _, label in items], [r for _, r, _ in items])))
+        return {**task_data, "images": [uploaded.get(uri, uri) for uri in task_data["images"]]}
+    def _upload_image(self, image_tensor, resolution: str = None) -> str:
+        if self._deferred is not None: return self._defer_upload(image_tensor, resolution)
+        cache, upload_settings = get_upload_cache(self.config.get("upload_cache")), self.upload_settings
+        digest, cache_key = self._upload_key(image_tensor, upload_settings, resolution)
+        cached_uri = cache.get(cache_key) if cache else None
+        if cached_uri: self.log(f"命中上传缓存, 复用图片URI: {cached_uri}"); self._image_digests[cached_uri], self._upload_keys[cached_uri] = digest, cache_key; _metrics.inc("vidu_upload_cache_hits_total"); return cached_uri
+        with _upload_flights_lock:
+            flight = _upload_flights.get(cache_key); leader = flight is None
+            if leader: flight = _upload_flights[cache_key] = Future()
+        if not leader:
+            # 同一 Key 上相同的图片正在上传 (例如批量节点的多个组合), 等待其结果而不是重复上传
+            self.log("相同的图片正在上传, 等待其结果..."); image_uri = flight.result()
+            self._image_digests[image_uri], self._upload_keys[image_uri] = digest, cache_key; return image_uri
+        try:
+            image_uri = self._upload_image_data(image_tensor, upload_settings, resolution)
+            if cache: cache.put(cache_key, image_uri)
+            flight.set_result(image_uri)
+        except BaseException as e:
+            # 上传失败时同一张图片在缓存中的旧 URI 也不再可信
+            if cache: cache.invalidate(cache_key)
+            flight.set_exception(e); raise
+        finally:
+            with _upload_flights_lock: _upload_flights.pop(cache_key, None)
+        self._image_digests[image_uri], self._upload_keys[image_uri] = digest, cache_key
+        self.log(f"图片上传完成, 获取到URI: {image_uri}"); return image_uri
+    def _upload_image_data(self, image_tensor, upload_settings: dict, resolution: str = None) -> str:
         self.log("开始上传图片..."); self.log("步骤 1/3: 请求上传许可...")
-        upload_request_data = self._make_request("POST", "/tools/v2/files/uploads", {"scene": "vidu"})
+        upload_request_data = self._make_request("POST", "/tools/v2/files/uploads", {"scene": "vidu"}, stage="upload_permit")
         put_url, resource_id = upload_request_data.get("put_url"), upload_request_data.get("id")
         self.log(f"获取到资源ID: {resource_id}"); self.log("步骤 2/3: 上传图片数据...")
-        pil_image = Image.fromarray((image_tensor[0] * 255).cpu().numpy().astype('uint8'))
-        img_byte_arr = io.BytesIO(); pil_image.save(img_byte_arr, format='PNG')
-        upload_response = requests.put(put_url, data=img_byte_arr.getvalue(), headers={"Content-Type": "image/png"})
+        with self._span("upload_encode", format=upload_settings["format"]): image_body, content_type = encode_image(image_tensor, upload_settings, resolution)
+        with self._span("upload_put", bytes=image_body.getbuffer().nbytes) as span:
+            upload_response = self.http.request("PUT", put_url, data=image_body, headers={"Content-Type": content_type}); span["retries"] = getattr(upload_response, "attempts", 1) - 1
         if upload_response.status_code != 200: raise Exception(f"上传图片失败 (状态码 {upload_response.status_code}): {upload_response.text}")
         etag = upload_response.headers.get("etag", "").strip('"')
         if not etag: raise Exception("未能从响应头中获取ETag")
         self.log(f"图片数据上传成功, ETag: {etag}"); self.log("步骤 3/3: 完成上传流程...")
         finish_endpoint = f"/tools/v2/files/uploads/{resource_id}/finish"
-        finish_response = self._make_request("PUT", finish_endpoint, data={"etag": etag})
+        finish_response = self._make_request("PUT", finish_endpoint, data={"etag": etag}, stage="upload_finish")
         image_uri = finish_response.get("uri")
         if not image_uri: raise Exception("完成上传后未能获取到图片URI")
-        self.log(f"图片上传完成, 获取到URI: {image_uri}"); return image_uri
+        return image_uri
+    def _invalidate_uploads(self, uris: list, error: Exception):
+        # 只有服务器以 4xx 拒绝请求时 (鉴权/额度/限流除外) 才不再复用其中来自上传缓存的图片URI; 超时、5xx 等不影响缓存
+        if not isinstance(error, ViduAPIError) or not 400 <= error.status_code < 500 or error.status_code in (401, 402, 403, 429): return
+        cache = get_upload_cache(self.config.get("upload_cache"))
+        for uri in uris:
+            cache_key = self._upload_keys.pop(uri, None)
+            if cache and cache_key: cache.invalidate(cache_key); self.log(f"已从上传缓存中移除图片URI: {uri}")
+    def _upload_images(self, image_tensors: list, labels: list = None, resolution=None) -> list:
+        # 并发上传多张图片, 返回的 URI 顺序与输入一致; 任意一张失败时取消尚未开始的上传并立即抛出. resolution 也可以是与图片一一对应的列表
+        labels = labels or [f"第 {i+1} 张图片" for i in range(len(image_tensors))]
+        resolutions = resolution if isinstance(resolution, list) else [resolution] * len(image_tensors)
+        if self._deferred is not None: return [self._defer_upload(t, r, label) for t, r, label in zip(image_tensors, resolutions, labels)]
+        self._pin_key()
+        if len(image_tensors) <= 1: return [self._upload_image(t, r) for t, r in zip(image_tensors, resolutions)]
+        max_workers = min(len(image_tensors), int(self.upload_settings["max_workers"]))
+        self.log(f"并发上传 {len(image_tensors)} 张图片 (并发数 {max_workers})...")
+        pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vidu-upload")
+        try:
+            futures = [pool.submit(self._upload_image, t, r) for t, r in zip(image_tensors, resolutions)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for label, future in zip(labels, futures):
+                if future in done and future.exception() is not None: raise Exception(f"上传{label}失败: {future.exception()}")
+            return [future.result() for future in futures]
+        finally: pool.shutdown(wait=False, cancel_futures=True)
     def _cancel_task(self, task_id: str):
         self.log(f"正在尝试向Vidu API发送取消请求, 任务ID: {task_id}")
         try:
+            _key_pool.throttle(self._pin_key())
             cancel_endpoint = f"/ent/v2/tasks/{task_id}/cancel"
             headers, url = {"Content-Type": "application/json", "Authorization": f"Token {self.token}"}, f"{self.api_base}{cancel_endpoint}"
-            response = requests.post(url, json={"id": task_id}, headers=headers, timeout=10)
+            response = self.http.request("POST", url, json={"id": task_id}, headers=headers, timeout=10)
             if response.status_code == 200: self.log(f"✅ 任务 {task_id} 取消请求已成功发送。")
             else: self.log(f"⚠️ 发送取消请求失败 (这可能是因为任务已完成或无法取消): {response.text}")
         except Exception as e: self.log(f"⚠️ 发送取消请求时发生网络错误: {e}")
+    @property
+    def scheduler(self) -> ViduTaskScheduler: return get_task_scheduler(self.config.get("scheduler"))
+    def _create_task(self, endpoint: str, task_data: dict, pending: dict = None):
+        # 先在负载最低的 Key 上占用名额, 再在该 Key 上上传尚未上传的图片 (图片URI与账户绑定); 返回 (task_id, 实际提交的请求体)
+        # 已为上传固定了 Key 时 (例如直接调用 _upload_image) 在同一个 Key 上占用名额
+        key_id = _key_pool.lease(self._key_id, self.log); self._use_key(key_id)
+        try:
+            if pending: task_data = self._resolve_uploads(task_data, pending)
+            task_id = self._make_request("POST", endpoint, task_data, stage="create_task").get("task_id")
+            if not task_id: raise Exception("创建任务后未能从响应中获取task_id")
+        except BaseException as e:
+            _key_pool.release(key_id)
+            self._invalidate_uploads(task_data.get("images") or [], e)
+            self._reset_trace(); raise
+        self.scheduler.bind_release(task_id, lambda: _key_pool.release(key_id))
+        return task_id, task_data
+    @property
+    def journal(self): return get_task_journal(self.config.get("journal"))
+    def _journal_state(self, task_id: str, state: str, **fields):
+        if self.journal: self.journal.record_state(task_id, state, **fields)
     def _wait_for_completion(self, task_id: str, timeout: int = 3600) -> dict:
+        query_endpoint, timeline = f"/ent/v2/tasks/{task_id}/creations", {"start": time.perf_counter(), "processing": None, "polls": 0}
+        def poll():
+            status_data = self._make_request("GET", query_endpoint, stage="poll", wait=False); state = status_data.get('state', '未知')
+            self.log(f"任务 {task_id} 当前状态: {state}"); timeline["polls"] += 1; _metrics.inc("vidu_polls_total")
+            if state in ("processing", "success") and timeline["processing"] is None: timeline["processing"] = time.perf_counter()
+            if state == "failed": self._journal_state(task_id, "failed", error=f"err_code={status_data.get('err_code', 'N/A')}")
+            elif state != "success": self._journal_state(task_id, state)
+            return status_data
         try:
             self.log(f"开始轮询任务状态, ID: {task_id}")
-            start_time, query_endpoint = time.time(), f"/ent/v2/tasks/{task_id}/creations"
-            while time.time() - start_time < timeout:
-                self.log("查询任务状态...")
-                status_data = self._make_request("GET", query_endpoint)
-                state = status_data.get("state", "未知")
-                self.log(f"当前状态: {state}")
-                if state == "success": self.log("任务成功完成!"); return status_data
-                elif state == "failed": err_code = status_data.get('err_code', 'N/A'); raise Exception(f"任务生成失败，错误码: {err_code}")
-                time.sleep(5)
-            raise TimeoutError(f"任务轮询超时（超过 {timeout} 秒）")
+            status_data = self.scheduler.watch(task_id, poll, timeout).result()
+            # 排队时间: 开始轮询到首次看到 processing; 渲染时间: processing 到 success (精度受轮询间隔限制)
+            end = time.perf_counter(); started_processing = timeline["processing"] or end
+            for stage, seconds in (("queue_wait", started_processing - timeline["start"]), ("render", end - started_processing)):
+                _metrics.observe("vidu_stage_duration_seconds", seconds, stage=stage); self._trace({"stage": stage, "outcome": "ok", "duration_ms": round(seconds * 1000, 1), "polls": timeline["polls"]})
+            self.log("任务成功完成!"); return status_data
         except KeyboardInterrupt:
-            self.log("!!! 接收到用户中断信号 !!!"); self._cancel_task(task_id); raise
+            self.log("!!! 接收到用户中断信号 !!!"); self.scheduler.forget(task_id); self._cancel_task(task_id); self._journal_state(task_id, "cancelled"); raise
+    def _collect_task(self, task_id: str, output_path: str, file_prefix: str):
+        # 等待任务完成并下载视频, 返回 (本地路径, 封面链接); 日志中已记录下载完成且文件仍在时直接返回
+        lock = self.journal.task_lock(task_id) if self.journal else threading.Lock()
+        with lock, self._traced(task_id):
+            entry = self.journal.get(task_id) if self.journal else None
+            if entry and entry["state"] == "downloaded" and os.path.isfile(entry.get("local_path") or ""):
+                self.log(f"任务 {task_id} 已下载过, 复用本地文件: {entry['local_path']}"); return entry["local_path"], entry.get("cover_url")
+            final_status = self._wait_for_completion(task_id); creations = final_status.get("creations", [])
+            if not creations: raise Exception("任务成功，但响应中未找到'creations'结果")
+            video_url, cover_url = creations[0].get("url"), creations[0].get("cover_url")
+            self._journal_state(task_id, "downloading", video_url=video_url, cover_url=cover_url)
+            try: local_file_path = self._download_video(video_url, output_path, file_prefix)
+            except Exception as e: self._journal_state(task_id, "download_failed", error=str(e)); raise
+            self._journal_state(task_id, "downloaded", local_path=os.path.abspath(local_file_path))
+            self.log(f"任务全部完成! 本地文件路径: {local_file_path}"); return local_file_path, cover_url
+    def _run_task(self, build_kwargs: dict, output_path: str, file_prefix: str, use_cache: bool = True):
+        # 先以图片内容哈希占位构造请求并查询结果缓存, 命中时直接返回, 不上传任何图片; 未命中时占用 Key 后才上传并创建任务
+        # 每次运行都不沿用上一次固定的 Key, 结束时 (包括命中缓存或构造请求失败) 也不保留
+        self._key_id, self._deferred, self._digest_memo = None, {}, {}; self._reset_trace()
+        try:
+            try: endpoint, task_data = self._build_task(**build_kwargs)
+            finally: pending, self._deferred = self._deferred, None
+            # 随机种子为 0 (或未指定) 时 Vidu 每次随机生成, 这类请求不读也不写结果缓存
+            if use_cache and task_data.get("seed", 0) == 0: self.log("随机种子为 0, 本次不使用结果缓存。"); use_cache = False
+            cache = get_result_cache(self.config.get("result_cache")) if use_cache else None
+            cache_key = ViduResultCache.make_key(self.api_base, endpoint, task_data, self._image_digests) if cache else None
+            cached = cache.get(cache_key) if cache else None
+            if cached:
+                self.log(f"命中结果缓存, 复用任务 {cached['task_id']} 的视频: {cached['local_path']}")
+                return (video_from_file(cached["local_path"]), cached.get("cover_url"), cached["task_id"])
+            task_id, task_data = self._create_task(endpoint, task_data, pending)
+            if self.journal: self.journal.record_submit(task_id, self.node_name, self.api_base, endpoint, task_data, output_path, file_prefix, self._key_id)
+            local_file_path, cover_url = self._collect_task(task_id, output_path, file_prefix)
+        finally: self._key_id = None; self._reset_trace()
+        if cache: cache.put(cache_key, task_id, cover_url, local_file_path)
+        video_output = video_from_file(local_file_path); return (video_output, cover_url, task_id)
+    @property
+    def download_settings(self) -> dict: return {**DEFAULT_DOWNLOAD_SETTINGS, **self.config.get("download", {})}
     def _download_video(self, video_url: str, output_path: str, file_prefix: str) -> str:
         if not video_url or not video_url.startswith('http'): raise ValueError(f"无效的video_url: {video_url}")
         self.log(f"开始下载视频: {video_url}"); os.makedirs(output_path, exist_ok=True)
-        filename = f"{file_prefix}_{int(time.time())}.mp4"; local_path = os.path.join(output_path, filename)
+        # 文件名带上时间和随机后缀, 并发任务不会互相覆盖; 先写入 .part 临时文件, 校验通过后再原子重命名
+        filename = f"{file_prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.mp4"; local_path = os.path.join(output_path, filename); tmp_path = f"{local_path}.part"
         self.log(f"将视频保存到: {local_path}")
-        with requests.get(video_url, stream=True) as r:
-            r.raise_for_status();
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192): f.write(chunk)
+        try:
+            with self._span("download") as span:
+                expected_size, etag = self._fetch_to_file(video_url, tmp_path, self.download_settings)
+                self._verify_download(tmp_path, expected_size, etag); span["bytes"] = os.path.getsize(tmp_path); os.replace(tmp_path, local_path)
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
         self.log("视频下载完成!"); return local_path
+    def _fetch_to_file(self, url: str, tmp_path: str, settings: dict):
+        import requests
+        # 单连接流式下载, 断线后用 Range + If-Range 从已写入的位置续传; 大文件且服务器支持 Range 时改为多段并行下载
+        chunk_size, written, attempt, expected_size, etag = int(settings["chunk_size"]), 0, 0, None, None
+        while True:
+            headers = {"Range": f"bytes={written}-"} if written else {}
+            if written and etag: headers["If-Range"] = etag
+            try:
+                with self.http.request("GET", url, stream=True, headers=headers) as r:
+                    r.raise_for_status()
+                    if written and r.status_code != 206: self.log("服务器不支持断点续传或文件已变化, 从头重新下载..."); written = 0
+                    if not written:
+                        encoded = r.headers.get("Content-Encoding", "identity") != "identity"
+                        expected_size = int(r.headers["Content-Length"]) if "Content-Length" in r.headers and not encoded else None
+                        etag = r.headers.get("ETag")
+                        if expected_size and expected_size >= int(settings["segment_threshold"]) and int(settings["segments"]) > 1 and r.headers.get("Accept-Ranges") == "bytes":
+                            r.close(); self._fetch_segments(url, tmp_path, expected_size, etag, settings); return expected_size, etag
+                    with open(tmp_path, 'r+b' if written else 'wb') as f:
+                        f.seek(written); f.truncate()
+                        for chunk in r.iter_content(chunk_size=chunk_size): f.write(chunk); written += len(chunk)
+                if expected_size is None or written >= expected_size: return expected_size, etag
+                raise requests.ConnectionError(f"连接提前关闭, 已接收 {written}/{expected_size} 字节")
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > int(settings["max_retries"]): raise Exception(f"视频下载失败, 已重试 {attempt - 1} 次: {e}")
+                self.log(f"下载中断 ({e}), 已下载 {written} 字节, 第 {attempt} 次续传..."); _metrics.inc("vidu_retries_total", stage="download"); time.sleep(min(2 ** attempt, 30))
+    def _fetch_segments(self, url: str, tmp_path: str, total_size: int, etag: str, settings: dict):
+        segments = int(settings["segments"]); self.log(f"文件大小 {total_size} 字节, 使用 {segments} 段并行下载...")
+        with open(tmp_path, 'wb') as f: f.truncate(total_size)
+        bounds = [(i * total_size // segments, (i + 1) * total_size // segments - 1) for i in range(segments)]
+        with ThreadPoolExecutor(max_workers=segments, thread_name_prefix="vidu-download") as pool:
+            for future in [pool.submit(self._fetch_range, url, tmp_path, start, end, etag, settings) for start, end in bounds]: future.result()
+    def _fetch_range(self, url: str, tmp_path: str, start: int, end: int, etag: str, settings: dict):
+        import requests
+        position, attempt = start, 0
+        while position <= end:
+            headers = {"Range": f"bytes={position}-{end}"}
+            if etag: headers["If-Range"] = etag
+            try:
+                with self.http.request("GET", url, stream=True, headers=headers) as r:
+                    if r.status_code != 206: raise Exception(f"分段下载失败, 服务器未返回部分内容 (状态码 {r.status_code})")
+                    with open(tmp_path, 'r+b') as f:
+                        f.seek(position)
+                        for chunk in r.iter_content(chunk_size=int(settings["chunk_size"])): f.write(chunk); position += len(chunk)
+                if position <= end: raise requests.ConnectionError(f"分段 {start}-{end} 提前结束")
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > int(settings["max_retries"]): raise Exception(f"分段 {start}-{end} 下载失败: {e}")
+                _metrics.inc("vidu_retries_total", stage="download")
+                time.sleep(min(2 ** attempt, 30))
+    def _verify_download(self, path: str, expected_size: int, etag: str):
+        actual_size = os.path.getsize(path)
+        if actual_size == 0: raise Exception("下载的视频文件为空")
+        if expected_size is not None and actual_size != expected_size: raise Exception(f"视频大小校验失败: 期望 {expected_size} 字节, 实际 {actual_size} 字节")
+        # 只有强 ETag 且形如 MD5 时才能用来校验内容 (分片上传的 ETag 带 "-N" 后缀, 不是文件的 MD5)
+        tag = (etag or "").strip('"')
+        if re.fullmatch(r"[0-9a-fA-F]{32}", tag):
+            digest = hashlib.md5()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b""): digest.update(block)
+            if digest.hexdigest().lower() != tag.lower(): raise Exception(f"视频校验失败: MD5 {digest.hexdigest()} 与 ETag {tag} 不一致")
 
 # ======================================================================================
 # NODE IMPLEMENTATIONS
@@ -99,12 +898,14 @@ class ViduPromptRecommender(ViduBaseNode):
     def recommend(self, **kwargs):
         # ... (函数体无变化)
         image, recommend_type_cn, self.api_base, count, resolution = kwargs.get("图像"), kwargs.get("推荐类型"), kwargs.get("API地址"), kwargs.get("数量"), kwargs.get("分辨率")
+        self._key_id = None; self._reset_trace()
         try:
             self.log(f"开始推荐提示词, 类型: {recommend_type_cn}")
             type_map = {"特效和图生视频": ["template", "img2video"],"仅特效": ["template"],"仅图生视频": ["img2video"],}; api_type = type_map.get(recommend_type_cn)
             image_uri = self._upload_image(image)
             task_data = {"images": [image_uri], "type": api_type, "count": count, "resolution": resolution}
-            response_data = self._make_request("POST", "/ent/v2/img2video-prompt-recommendation", task_data)
+            try: response_data = self._make_request("POST", "/ent/v2/img2video-prompt-recommendation", task_data)
+            except Exception as e: self._invalidate_uploads([image_uri], e); raise
             prompts = response_data.get("prompts", [])
             if not prompts: return ("未收到任何提示词推荐。",)
             output_lines, template_prompts, img2video_prompts = [], [p for p in prompts if p.get("type") == "template"], [p for p in prompts if p.get("type") == "img2video"]
@@ -119,6 +920,7 @@ class ViduPromptRecommender(ViduBaseNode):
             return ("\n".join(output_lines),)
         except Exception as e:
             self.log(f"推荐提示词过程发生错误: {e}"); return (f"错误: {e}",)
+        finally: self._reset_trace()
 
 class ViduText2VideoNode(ViduBaseNode):
     @classmethod
@@ -133,7 +935,7 @@ class ViduText2VideoNode(ViduBaseNode):
                 "随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}), 
                 "动态幅度": (["自动", "小", "中", "大"],), 
             }, 
-            "optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Text2Video"}),}
+            "optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}), "使用结果缓存": ("BOOLEAN", {"default": True}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Text2Video"}),}
         }
     RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "封面链接", "任务ID"), "generate", "comfyui_VIDU_API"
     
@@ -144,27 +946,25 @@ class ViduText2VideoNode(ViduBaseNode):
         if profile == "vidu1.5 - 8秒" and resolution != "720p": return f"错误: 配置 '{profile}' 仅支持 720p 分辨率。"
         return True
 
+    def _build_task(self, **kwargs):
+        profile, prompt, style_cn, resolution, aspect_ratio, seed, movement_amplitude_cn = kwargs.get("运行配置"), kwargs.get("提示词"), kwargs.get("风格"), kwargs.get("分辨率"), kwargs.get("宽高比"), kwargs.get("随机种子"), kwargs.get("动态幅度")
+        model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
+        self.log(f"开始文生视频任务, 模型: {model}, 时长: {duration}s, 风格: {style_cn}, 提示词: '{prompt[:50]}...'")
+        style_map, move_map = {"通用": "general", "动漫": "anime"}, {"自动": "auto", "小": "small", "中": "medium", "大": "large"}
+        api_style, api_move = style_map.get(style_cn), move_map.get(movement_amplitude_cn)
+        task_data = {"model": model, "style": api_style, "prompt": prompt, "duration": duration, "seed": seed, "aspect_ratio": aspect_ratio, "resolution": resolution, "movement_amplitude": api_move}
+        return "/ent/v2/text2video", task_data
+
     def generate(self, **kwargs):
-        profile, prompt, style_cn, resolution, aspect_ratio, seed, movement_amplitude_cn, self.api_base, output_path, file_prefix = kwargs.get("运行配置"), kwargs.get("提示词"), kwargs.get("风格"), kwargs.get("分辨率"), kwargs.get("宽高比"), kwargs.get("随机种子"), kwargs.get("动态幅度"), kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
+        self.api_base, output_path, file_prefix = kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
         try:
-            model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
-            self.log(f"开始文生视频任务, 模型: {model}, 时长: {duration}s, 风格: {style_cn}, 提示词: '{prompt[:50]}...'")
-            style_map, move_map = {"通用": "general", "动漫": "anime"}, {"自动": "auto", "小": "small", "中": "medium", "大": "large"}
-            api_style, api_move = style_map.get(style_cn), move_map.get(movement_amplitude_cn)
-            task_data = {"model": model, "style": api_style, "prompt": prompt, "duration": duration, "seed": seed, "aspect_ratio": aspect_ratio, "resolution": resolution, "movement_amplitude": api_move}
-            task_id = self._make_request("POST", "/ent/v2/text2video", task_data).get("task_id")
-            if not task_id: raise Exception("创建任务后未能从响应中获取task_id")
-            final_status = self._wait_for_completion(task_id); creations = final_status.get("creations", [])
-            if not creations: raise Exception("任务成功，但响应中未找到'creations'结果")
-            video_url, cover_url = creations[0].get("url"), creations[0].get("cover_url")
-            local_file_path = self._download_video(video_url, output_path, file_prefix)
-            self.log(f"任务全部完成! 本地文件路径: {local_file_path}"); video_output = VideoFromFile(local_file_path); return (video_output, cover_url, task_id)
+            return self._run_task(kwargs, output_path, file_prefix, kwargs.get("使用结果缓存", True))
         except Exception as e:
             self.log(f"文生视频过程发生错误: {e}"); return (None, f"错误: {e}", "error")
 
 class ViduImage2VideoNode(ViduBaseNode):
     @classmethod
-    def INPUT_TYPES(cls): return {"required": {"运行配置": (["viduq1 - 5秒", "vidu2.0 - 4秒", "vidu2.0 - 8秒", "vidu1.5 - 4秒", "vidu1.5 - 8秒"],),"图像": ("IMAGE",), "提示词": ("STRING", {"multiline": True, "default": "宇航员挥手，镜头向上移动。"}),"分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}), "随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}), "动态幅度": (["自动", "小", "中", "大"],), }, "optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Image2Video"}),}}
+    def INPUT_TYPES(cls): return {"required": {"运行配置": (["viduq1 - 5秒", "vidu2.0 - 4秒", "vidu2.0 - 8秒", "vidu1.5 - 4秒", "vidu1.5 - 8秒"],),"图像": ("IMAGE",), "提示词": ("STRING", {"multiline": True, "default": "宇航员挥手，镜头向上移动。"}),"分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}), "随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}), "动态幅度": (["自动", "小", "中", "大"],), }, "optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}), "使用结果缓存": ("BOOLEAN", {"default": True}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Image2Video"}),}}
     RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "封面链接", "任务ID"), "generate", "comfyui_VIDU_API"
     
     @classmethod
@@ -175,27 +975,25 @@ class ViduImage2VideoNode(ViduBaseNode):
         if profile == "vidu1.5 - 8秒" and resolution != "720p": return f"错误: 配置 '{profile}' 仅支持 720p 分辨率。"
         return True
 
+    def _build_task(self, **kwargs):
+        profile, image, prompt, resolution, seed, movement_amplitude_cn = kwargs.get("运行配置"), kwargs.get("图像"), kwargs.get("提示词"), kwargs.get("分辨率"), kwargs.get("随机种子"), kwargs.get("动态幅度")
+        model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
+        self.log(f"开始图生视频任务, 模型: {model}, 时长: {duration}s, 提示词: '{prompt[:50]}...'")
+        move_map = {"自动": "auto", "小": "small", "中": "medium", "大": "large"}; api_move = move_map.get(movement_amplitude_cn)
+        image_uri = self._upload_image(image, resolution)
+        task_data = {"model": model, "images": [image_uri], "prompt": prompt, "duration": duration, "seed": seed, "resolution": resolution, "movement_amplitude": api_move}
+        return "/ent/v2/img2video", task_data
+
     def generate(self, **kwargs):
-        profile, image, prompt, resolution, seed, movement_amplitude_cn, self.api_base, output_path, file_prefix = kwargs.get("运行配置"), kwargs.get("图像"), kwargs.get("提示词"), kwargs.get("分辨率"), kwargs.get("随机种子"), kwargs.get("动态幅度"), kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
+        self.api_base, output_path, file_prefix = kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
         try:
-            model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
-            self.log(f"开始图生视频任务, 模型: {model}, 时长: {duration}s, 提示词: '{prompt[:50]}...'")
-            move_map = {"自动": "auto", "小": "small", "中": "medium", "大": "large"}; api_move = move_map.get(movement_amplitude_cn)
-            image_uri = self._upload_image(image)
-            task_data = {"model": model, "images": [image_uri], "prompt": prompt, "duration": duration, "seed": seed, "resolution": resolution, "movement_amplitude": api_move}
-            task_id = self._make_request("POST", "/ent/v2/img2video", task_data).get("task_id")
-            if not task_id: raise Exception("创建任务后未能从响应中获取task_id")
-            final_status = self._wait_for_completion(task_id); creations = final_status.get("creations", [])
-            if not creations: raise Exception("任务成功，但响应中未找到'creations'结果")
-            video_url, cover_url = creations[0].get("url"), creations[0].get("cover_url")
-            local_file_path = self._download_video(video_url, output_path, file_prefix)
-            self.log(f"任务全部完成! 本地文件路径: {local_file_path}"); video_output = VideoFromFile(local_file_path); return (video_output, cover_url, task_id)
+            return self._run_task(kwargs, output_path, file_prefix, kwargs.get("使用结果缓存", True))
         except Exception as e:
             self.log(f"图生视频过程发生错误: {e}"); return (None, f"错误: {e}", "error")
 
 class ViduReference2VideoNode(ViduBaseNode):
     @classmethod
-    def INPUT_TYPES(cls): return {"required": {"运行配置": (["viduq1 - 5秒", "vidu2.0 - 4秒", "vidu1.5 - 4秒", "vidu1.5 - 8秒"],), "参考图_1": ("IMAGE",),"提示词": ("STRING", {"multiline": True, "default": "一个可爱的角色在奔跑。"}),"分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}),"宽高比": (["16:9", "9:16", "1:1"],),"随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),"动态幅度": (["自动", "小", "中", "大"],),},"optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}),"参考图_2": ("IMAGE",), "参考图_3": ("IMAGE",), "参考图_4": ("IMAGE",),"参考图_5": ("IMAGE",), "参考图_6": ("IMAGE",), "参考图_7": ("IMAGE",), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Reference2Video"}),}}
+    def INPUT_TYPES(cls): return {"required": {"运行配置": (["viduq1 - 5秒", "vidu2.0 - 4秒", "vidu1.5 - 4秒", "vidu1.5 - 8秒"],), "参考图_1": ("IMAGE",),"提示词": ("STRING", {"multiline": True, "default": "一个可爱的角色在奔跑。"}),"分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}),"宽高比": (["16:9", "9:16", "1:1"],),"随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),"动态幅度": (["自动", "小", "中", "大"],),},"optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}),"参考图_2": ("IMAGE",), "参考图_3": ("IMAGE",), "参考图_4": ("IMAGE",),"参考图_5": ("IMAGE",), "参考图_6": ("IMAGE",), "参考图_7": ("IMAGE",), "使用结果缓存": ("BOOLEAN", {"default": True}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Reference2Video"}),}}
     RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "封面链接", "任务ID"), "generate", "comfyui_VIDU_API"
     
     @classmethod
@@ -207,34 +1005,31 @@ class ViduReference2VideoNode(ViduBaseNode):
         # 'vidu1.5 - 4秒' 在此接口支持所有分辨率, 无需校验
         return True
 
-    def generate(self, **kwargs):
+    def _build_task(self, **kwargs):
         profile, all_images_cn = kwargs.get("运行配置"), [kwargs.get(f"参考图_{i+1}") for i in range(7)]
-        prompt, resolution, aspect_ratio, seed, movement_amplitude_cn, self.api_base, output_path, file_prefix = kwargs.get("提示词"), kwargs.get("分辨率"), kwargs.get("宽高比"), kwargs.get("随机种子"), kwargs.get("动态幅度"), kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
+        prompt, resolution, aspect_ratio, seed, movement_amplitude_cn = kwargs.get("提示词"), kwargs.get("分辨率"), kwargs.get("宽高比"), kwargs.get("随机种子"), kwargs.get("动态幅度")
+        model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
+        # 虽然我们按文档加入了viduq1, 但根据之前的经验, 仍可能被API拒绝。
+        if model == "viduq1": self.log("警告: 'viduq1' 模型根据之前测试可能不被此接口支持, 如遇错误请更换配置。")
+        self.log(f"开始参考生视频任务, 模型: {model}, 时长: {duration}s, 提示词: '{prompt[:50]}...'")
+        move_map = {"自动": "auto", "小": "small", "中": "medium", "大": "large"}; api_move = move_map.get(movement_amplitude_cn)
+        provided = [(i, t) for i, t in enumerate(all_images_cn) if t is not None]
+        if not provided: raise ValueError("必须至少提供一张参考图片。")
+        image_uris = self._upload_images([t for _, t in provided], [f"第 {i+1} 张参考图" for i, _ in provided], resolution)
+        self.log(f"共 {len(image_uris)} 张参考图。")
+        task_data = {"model": model, "images": image_uris, "prompt": prompt, "duration": duration, "seed": seed, "aspect_ratio": aspect_ratio, "resolution": resolution, "movement_amplitude": api_move}
+        return "/ent/v2/reference2video", task_data
+
+    def generate(self, **kwargs):
+        self.api_base, output_path, file_prefix = kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
         try:
-            model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
-            # 虽然我们按文档加入了viduq1, 但根据之前的经验, 仍可能被API拒绝。
-            if model == "viduq1": self.log("警告: 'viduq1' 模型根据之前测试可能不被此接口支持, 如遇错误请更换配置。")
-            self.log(f"开始参考生视频任务, 模型: {model}, 时长: {duration}s, 提示词: '{prompt[:50]}...'")
-            move_map = {"自动": "auto", "小": "small", "中": "medium", "大": "large"}; api_move = move_map.get(movement_amplitude_cn)
-            image_uris = []
-            for i, image_tensor in enumerate(all_images_cn):
-                if image_tensor is not None: self.log(f"上传第 {i+1} 张参考图..."); uri = self._upload_image(image_tensor); image_uris.append(uri)
-            if not image_uris: raise ValueError("必须至少提供一张参考图片。")
-            self.log(f"总共上传了 {len(image_uris)} 张图片。")
-            task_data = {"model": model, "images": image_uris, "prompt": prompt, "duration": duration, "seed": seed, "aspect_ratio": aspect_ratio, "resolution": resolution, "movement_amplitude": api_move}
-            task_id = self._make_request("POST", "/ent/v2/reference2video", task_data).get("task_id")
-            if not task_id: raise Exception("创建任务后未能从响应中获取task_id")
-            final_status = self._wait_for_completion(task_id); creations = final_status.get("creations", [])
-            if not creations: raise Exception("任务成功，但响应中未找到'creations'结果")
-            video_url, cover_url = creations[0].get("url"), creations[0].get("cover_url")
-            local_file_path = self._download_video(video_url, output_path, file_prefix)
-            self.log(f"任务全部完成! 本地文件路径: {local_file_path}"); video_output = VideoFromFile(local_file_path); return (video_output, cover_url, task_id)
+            return self._run_task(kwargs, output_path, file_prefix, kwargs.get("使用结果缓存", True))
         except Exception as e:
             self.log(f"参考生视频过程发生错误: {e}"); return (None, f"错误: {e}", "error")
 
 class ViduStartEnd2VideoNode(ViduBaseNode):
     @classmethod
-    def INPUT_TYPES(cls): return {"required": {"运行配置": (["viduq1 - 5秒", "viduq1-classic - 5秒", "vidu2.0 - 4秒", "vidu2.0 - 8秒", "vidu1.5 - 4秒", "vidu1.5 - 8秒"],), "起始帧": ("IMAGE",),"结束帧": ("IMAGE",),"分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}),"随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),"动态幅度": (["自动", "小", "中", "大"],),},"optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}),"提示词": ("STRING", {"multiline": True, "default": ""}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_StartEnd2Video"}),}}
+    def INPUT_TYPES(cls): return {"required": {"运行配置": (["viduq1 - 5秒", "viduq1-classic - 5秒", "vidu2.0 - 4秒", "vidu2.0 - 8秒", "vidu1.5 - 4秒", "vidu1.5 - 8秒"],), "起始帧": ("IMAGE",),"结束帧": ("IMAGE",),"分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}),"随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),"动态幅度": (["自动", "小", "中", "大"],),},"optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}),"提示词": ("STRING", {"multiline": True, "default": ""}), "使用结果缓存": ("BOOLEAN", {"default": True}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_StartEnd2Video"}),}}
     RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "封面链接", "任务ID"), "generate", "comfyui_VIDU_API"
     
     @classmethod
@@ -245,58 +1040,167 @@ class ViduStartEnd2VideoNode(ViduBaseNode):
         if profile == "vidu1.5 - 8秒" and resolution != "720p": return f"错误: 配置 '{profile}' 仅支持 720p 分辨率。"
         return True
 
+    def _build_task(self, **kwargs):
+        profile, start_frame, end_frame, resolution, seed, movement_amplitude_cn, prompt = kwargs.get("运行配置"), kwargs.get("起始帧"), kwargs.get("结束帧"), kwargs.get("分辨率"), kwargs.get("随机种子"), kwargs.get("动态幅度"), kwargs.get("提示词")
+        model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
+        self.log(f"开始首尾帧生视频任务, 模型: {model}, 时长: {duration}s"); self.log("注意: 请确保首尾帧图像的分辨率比例在0.8到1.25之间。")
+        move_map = {"自动": "auto", "小": "small", "中": "medium", "大": "large"}; api_move = move_map.get(movement_amplitude_cn)
+        self.log("上传起始帧与结束帧图像..."); start_uri, end_uri = self._upload_images([start_frame, end_frame], ["起始帧图像", "结束帧图像"], resolution)
+        task_data = {"model": model, "images": [start_uri, end_uri], "duration": duration, "seed": seed, "resolution": resolution, "movement_amplitude": api_move}
+        if prompt and prompt.strip(): task_data["prompt"] = prompt
+        return "/ent/v2/start-end2video", task_data
+
     def generate(self, **kwargs):
-        profile, start_frame, end_frame, resolution, seed, movement_amplitude_cn, self.api_base, prompt, output_path, file_prefix = kwargs.get("运行配置"), kwargs.get("起始帧"), kwargs.get("结束帧"), kwargs.get("分辨率"), kwargs.get("随机种子"), kwargs.get("动态幅度"), kwargs.get("API地址"), kwargs.get("提示词"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
+        self.api_base, output_path, file_prefix = kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
         try:
-            model, duration_str = profile.split(' - '); duration = int(duration_str.replace('秒', ''))
-            self.log(f"开始首尾帧生视频任务, 模型: {model}, 时长: {duration}s"); self.log("注意: 请确保首尾帧图像的分辨率比例在0.8到1.25之间。")
-            move_map = {"自动": "auto", "小": "small", "中": "medium", "大": "large"}; api_move = move_map.get(movement_amplitude_cn)
-            self.log("上传起始帧图像..."); start_uri = self._upload_image(start_frame)
-            self.log("上传结束帧图像..."); end_uri = self._upload_image(end_frame)
-            task_data = {"model": model, "images": [start_uri, end_uri], "duration": duration, "seed": seed, "resolution": resolution, "movement_amplitude": api_move}
-            if prompt and prompt.strip(): task_data["prompt"] = prompt
-            task_id = self._make_request("POST", "/ent/v2/start-end2video", task_data).get("task_id")
-            if not task_id: raise Exception("创建任务后未能从响应中获取task_id")
-            final_status = self._wait_for_completion(task_id); creations = final_status.get("creations", [])
-            if not creations: raise Exception("任务成功，但响应中未找到'creations'结果")
-            video_url, cover_url = creations[0].get("url"), creations[0].get("cover_url")
-            local_file_path = self._download_video(video_url, output_path, file_prefix)
-            self.log(f"任务全部完成! 本地文件路径: {local_file_path}"); video_output = VideoFromFile(local_file_path); return (video_output, cover_url, task_id)
+            return self._run_task(kwargs, output_path, file_prefix, kwargs.get("使用结果缓存", True))
         except Exception as e:
             self.log(f"首尾帧生视频过程发生错误: {e}"); return (None, f"错误: {e}", "error")
 
 class ViduFeaturedPresetNode(ViduBaseNode):
     @classmethod
-    def INPUT_TYPES(cls): return {"required": {"预设模板": (["outfit_show"],),},"optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}),"提示词": ("STRING", {"multiline": True}),"图像_1": ("IMAGE",),"图像_2": ("IMAGE",),"背景音乐": ("BOOLEAN", {"default": True}),"随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),"额外JSON参数": ("STRING", {"multiline": True, "default": "{}"}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Preset"}),}}
+    def INPUT_TYPES(cls): return {"required": {"预设模板": (["outfit_show"],),},"optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}),"提示词": ("STRING", {"multiline": True}),"图像_1": ("IMAGE",),"图像_2": ("IMAGE",),"背景音乐": ("BOOLEAN", {"default": True}),"随机种子": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),"额外JSON参数": ("STRING", {"multiline": True, "default": "{}"}), "使用结果缓存": ("BOOLEAN", {"default": True}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Preset"}),}}
     RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "封面链接", "任务ID"), "generate", "comfyui_VIDU_API"
+    def _build_task(self, **kwargs):
+        template_name, prompt, image_1, image_2, bgm, seed, extra_params_json = kwargs.get("预设模板"), kwargs.get("提示词"), kwargs.get("图像_1"), kwargs.get("图像_2"), kwargs.get("背景音乐"), kwargs.get("随机种子"), kwargs.get("额外JSON参数")
+        self.log(f"开始特色预设任务, 模板: {template_name}")
+        task_data = {"template": template_name}
+        if template_name == "outfit_show":
+            self.log("处理 'outfit_show' 模板: 需要2张图片和1个提示词。")
+            provided = [(i, t) for i, t in enumerate((image_1, image_2)) if t is not None]
+            if len(provided) < 2: raise ValueError("'outfit_show' 模板需要2张图片。")
+            image_uris = self._upload_images([t for _, t in provided], [f"图片{i+1}" for i, _ in provided])
+            task_data.update({"images": image_uris, "prompt": prompt, "bgm": bgm, "seed": seed})
+        try:
+            extra_params = json.loads(extra_params_json)
+            if extra_params: self.log(f"已合并额外参数: {extra_params}"); task_data.update(extra_params)
+        except json.JSONDecodeError: raise ValueError("`额外JSON参数` 格式无效，必须是合法的JSON。")
+        return "/ent/v2/template2video", task_data
+
     def generate(self, **kwargs):
-        template_name, self.api_base, prompt, image_1, image_2, bgm, seed, extra_params_json, output_path, file_prefix = kwargs.get("预设模板"), kwargs.get("API地址"), kwargs.get("提示词"), kwargs.get("图像_1"), kwargs.get("图像_2"), kwargs.get("背景音乐"), kwargs.get("随机种子"), kwargs.get("额外JSON参数"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
+        self.api_base, output_path, file_prefix = kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀")
         try:
-            self.log(f"开始特色预设任务, 模板: {template_name}")
-            task_data = {"template": template_name}
-            if template_name == "outfit_show":
-                self.log("处理 'outfit_show' 模板: 需要2张图片和1个提示词。")
-                image_uris = []
-                if image_1 is not None: self.log("上传图片1..."); image_uris.append(self._upload_image(image_1))
-                if image_2 is not None: self.log("上传图片2..."); image_uris.append(self._upload_image(image_2))
-                if len(image_uris) < 2: raise ValueError("'outfit_show' 模板需要2张图片。")
-                task_data.update({"images": image_uris, "prompt": prompt, "bgm": bgm, "seed": seed})
-            try:
-                extra_params = json.loads(extra_params_json)
-                if extra_params: self.log(f"已合并额外参数: {extra_params}"); task_data.update(extra_params)
-            except json.JSONDecodeError: raise ValueError("`额外JSON参数` 格式无效，必须是合法的JSON。")
-            task_id = self._make_request("POST", "/ent/v2/template2video", task_data).get("task_id")
-            if not task_id: raise Exception("创建任务后未能从响应中获取task_id")
-            final_status = self._wait_for_completion(task_id); creations = final_status.get("creations", [])
-            if not creations: raise Exception("任务成功，但响应中未找到'creations'结果")
-            video_url, cover_url = creations[0].get("url"), creations[0].get("cover_url")
-            local_file_path = self._download_video(video_url, output_path, file_prefix)
-            self.log(f"任务全部完成! 本地文件路径: {local_file_path}"); video_output = VideoFromFile(local_file_path); return (video_output, cover_url, task_id)
+            return self._run_task(kwargs, output_path, file_prefix, kwargs.get("使用结果缓存", True))
         except Exception as e:
             self.log(f"特色预设过程发生错误: {e}"); return (None, f"错误: {e}", "error")
 
+class ViduBatchNode(ViduBaseNode):
+    # 批量提交 提示词 x 随机种子 x 图像 的所有组合; 每个组合复用对应生成节点的 _build_task 构造请求, 创建/轮询/下载并发进行
+    TARGETS = {"文生视频": ViduText2VideoNode, "图生视频": ViduImage2VideoNode, "参考生视频": ViduReference2VideoNode, "首尾帧生视频": ViduStartEnd2VideoNode, "特色预设": ViduFeaturedPresetNode}
+    IMAGE_KEYS = {"文生视频": (), "图生视频": ("图像",), "参考生视频": ("参考图_1", "参考图_2"), "首尾帧生视频": ("起始帧", "结束帧"), "特色预设": ("图像_1", "图像_2")}
+    @classmethod
+    def INPUT_TYPES(cls): return {"required": {"生成类型": (list(cls.TARGETS),), "运行配置": ("STRING", {"multiline": False, "default": "viduq1 - 5秒"}), "提示词列表": ("STRING", {"multiline": True, "default": "宇航员穿着宇航服在雾中行走，令人印象深刻的全景场面。"}), "随机种子列表": ("STRING", {"multiline": False, "default": "0"}), "分辨率": (["360p", "720p", "1080p"], {"default": "1080p"}), "宽高比": (["16:9", "9:16", "1:1"],), "风格": (["通用", "动漫"],), "动态幅度": (["自动", "小", "中", "大"],), "最大并发": ("INT", {"default": 4, "min": 1, "max": 32}),}, "optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}), "图像": ("IMAGE",), "图像_2": ("IMAGE",), "预设模板": (["outfit_show"],), "背景音乐": ("BOOLEAN", {"default": True}), "额外JSON参数": ("STRING", {"multiline": True, "default": "{}"}), "使用结果缓存": ("BOOLEAN", {"default": True}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Batch"}),}}
+    RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "任务ID", "错误信息"), "generate", "comfyui_VIDU_API"
+    OUTPUT_IS_LIST = (True, True, True)
+
+    @classmethod
+    def VALIDATE_INPUTS(cls, **kwargs):
+        target = cls.TARGETS.get(kwargs.get("生成类型"))
+        if target is None or target is ViduFeaturedPresetNode: return True
+        profiles = target.INPUT_TYPES()["required"]["运行配置"][0]
+        if kwargs.get("运行配置") not in profiles: return f"错误: {kwargs.get('生成类型')} 不支持配置 '{kwargs.get('运行配置')}', 可选: {', '.join(profiles)}"
+        return target.VALIDATE_INPUTS(**kwargs)
+
+    def _expand_variants(self, **kwargs) -> list:
+        prompts = [line.strip() for line in (kwargs.get("提示词列表") or "").splitlines() if line.strip()] or [""]
+        try: seeds = [int(x) for x in (kwargs.get("随机种子列表") or "0").replace("\n", ",").split(",") if x.strip()] or [0]
+        except ValueError: raise ValueError("`随机种子列表` 必须是以逗号或换行分隔的整数。")
+        image, image_2, image_keys = kwargs.get("图像"), kwargs.get("图像_2"), self.IMAGE_KEYS[kwargs.get("生成类型")]
+        if image_keys and image is None: raise ValueError(f"{kwargs.get('生成类型')} 需要连接 `图像` 输入。")
+        # 图像的每一帧作为一个组合; 图像_2 帧数与图像相同时逐帧对应, 否则所有组合共用其第一帧
+        frames = [image[i:i+1] for i in range(image.shape[0])] if image_keys else [None]
+        seconds = [None] * len(frames) if image_2 is None else ([image_2[i:i+1] for i in range(len(frames))] if image_2.shape[0] == len(frames) else [image_2[0:1]] * len(frames))
+        common = {k: kwargs.get(k) for k in ("运行配置", "分辨率", "宽高比", "风格", "动态幅度", "预设模板", "背景音乐", "额外JSON参数")}
+        variants = []
+        for i, frame in enumerate(frames):
+            for prompt in prompts:
+                for seed in seeds:
+                    variant = {**common, "提示词": prompt, "随机种子": seed}
+                    for key, value in zip(image_keys, (frame, seconds[i])): variant[key] = value
+                    variants.append(variant)
+        return variants
+
+    def _run_variant(self, index: int, target_cls, variant: dict, output_path: str, file_prefix: str, use_cache: bool):
+        # 每个组合各自占用负载最低的 Key; 共用的图片在每个 Key 上只上传一次 (见 _upload_image 中的并发合并与上传缓存)
+        node = target_cls(); node.api_base, node.node_name = self.api_base, f"{target_cls.__name__}#{index+1}"
+        video, _, task_id = node._run_task(variant, output_path, f"{file_prefix}_{index+1:03d}", use_cache)
+        return video, task_id
+
+    def generate(self, **kwargs):
+        self.api_base, output_path, file_prefix, max_workers = kwargs.get("API地址"), kwargs.get("输出路径"), kwargs.get("文件名前缀"), kwargs.get("最大并发") or 1
+        try:
+            target_cls, variants = self.TARGETS[kwargs.get("生成类型")], self._expand_variants(**kwargs)
+        except Exception as e:
+            self.log(f"批量生成参数错误: {e}"); return ([None], ["error"], [f"错误: {e}"])
+        self.log(f"开始批量生成, 类型: {kwargs.get('生成类型')}, 共 {len(variants)} 个组合, 最大并发: {max_workers}")
+        videos, task_ids, errors = [None] * len(variants), ["error"] * len(variants), [""] * len(variants)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vidu-batch") as pool:
+            futures = {pool.submit(self._run_variant, i, target_cls, variant, output_path, file_prefix, kwargs.get("使用结果缓存", True)): i for i, variant in enumerate(variants)}
+            for future, i in futures.items():
+                try: videos[i], task_ids[i] = future.result()
+                except Exception as e: self.log(f"第 {i+1} 个组合失败: {e}"); errors[i] = f"错误: {e}"
+        self.log(f"批量生成结束, 成功 {errors.count('')}/{len(variants)} 个。")
+        return (videos, task_ids, errors)
+
+class ViduTaskRecoveryNode(ViduBaseNode):
+    # 按任务ID找回已提交的任务: 继续轮询并下载视频; 任务ID留空时只列出任务日志中最近的任务
+    @classmethod
+    def INPUT_TYPES(cls): return {"required": {"任务ID": ("STRING", {"multiline": False, "default": ""}),}, "optional": {"API地址": ("STRING", {"multiline": False, "default": "https://api.vidu.cn"}), "输出路径": ("STRING", {"default": "output"}), "文件名前缀": ("STRING", {"default": "Vidu_Recovered"}),}}
+    RETURN_TYPES, RETURN_NAMES, FUNCTION, CATEGORY = (IO.VIDEO, "STRING", "STRING"), ("video", "封面链接", "任务列表"), "recover", "comfyui_VIDU_API"
+
+    def _format_journal(self, limit: int = 20) -> str:
+        if not self.journal: return "任务日志未启用。"
+        entries = self.journal.recent(limit)
+        if not entries: return "任务日志为空。"
+        lines = [f"{'任务ID':<24} {'状态':<16} {'节点':<28} {'提交时间':<20} 本地文件/错误"]
+        for e in entries: lines.append(f"{e['task_id']:<24} {e['state'] or '':<16} {e['node'] or '':<28} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['created_at'] or 0)):<20} {e['local_path'] or e['error'] or ''}")
+        return "\n".join(lines)
+
+    def _collect_leased(self, task_id: str, output_path: str, file_prefix: str):
+        # 恢复的任务同样占用其 Key 的并发名额, 任务结束时由调度器归还; 该任务已在轮询中时不重复计数
+        key_id = self._pin_key(); release = lambda: _key_pool.release(key_id)
+        if self.scheduler.bind_release(task_id, release): _key_pool.acquire(key_id)
+        try: return self._collect_task(task_id, output_path, file_prefix)
+        finally: self.scheduler.unbind_release(task_id, release)
+
+    def _resume(self, entry: dict):
+        task_id, self.api_base = entry["task_id"], entry.get("api_base") or "https://api.vidu.cn"
+        if entry.get("key_id") and _key_pool.has(entry["key_id"]): self._use_key(entry["key_id"])
+        try: local_file_path, _ = self._collect_leased(task_id, entry.get("output_path") or "output", entry.get("file_prefix") or "Vidu_Recovered"); self.log(f"已恢复任务 {task_id}: {local_file_path}")
+        except Exception as e: self.log(f"恢复任务 {task_id} 失败: {e}")
+
+    def recover(self, **kwargs):
+        task_id = (kwargs.get("任务ID") or "").strip()
+        if not task_id: return (None, "", self._format_journal())
+        entry = (self.journal.get(task_id) if self.journal else None) or {}
+        self.api_base = entry.get("api_base") or kwargs.get("API地址")
+        output_path, file_prefix = entry.get("output_path") or kwargs.get("输出路径"), entry.get("file_prefix") or kwargs.get("文件名前缀")
+        # 任务只能用提交它的账户查询: 日志中记录了 key_id 时使用对应的 Key, 否则使用负载最低的 Key
+        self._key_id = entry["key_id"] if entry.get("key_id") and _key_pool.has(entry["key_id"]) else None; self._pin_key()
+        try:
+            self.log(f"开始恢复任务: {task_id}")
+            if not entry: self._journal_state(task_id, "recovering", api_base=self.api_base, key_id=self._key_id, output_path=output_path, file_prefix=file_prefix)
+            local_file_path, cover_url = self._collect_leased(task_id, output_path, file_prefix)
+            return (video_from_file(local_file_path), cover_url, self._format_journal())
+        except Exception as e:
+            self.log(f"恢复任务过程发生错误: {e}"); return (None, f"错误: {e}", self._format_journal())
+
+def resume_unfinished_tasks():
+    # ComfyUI 启动时在后台把任务日志中未完成的任务重新接入轮询与下载, 不阻塞节点加载
+    def worker():
+        try: node = ViduTaskRecoveryNode()
+        except Exception as e: print(f"[Vidu::ViduTaskRecoveryNode] 跳过未完成任务的恢复: {e}"); return
+        settings = node.config.get("journal", {})
+        if not settings.get("resume_on_startup", True) or node.journal is None: return
+        entries = node.journal.unfinished(float(settings.get("resume_max_age_seconds", 24 * 3600)))
+        if not entries: return
+        node.log(f"发现 {len(entries)} 个未完成的任务, 重新接入轮询与下载...")
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="vidu-resume") as pool:
+            for entry in entries: pool.submit(lambda e: ViduTaskRecoveryNode()._resume(e), entry)
+    threading.Thread(target=worker, name="vidu-resume", daemon=True).start()
+
 # ======================================================================================
 # REGISTRATION
 # ======================================================================================
-NODE_CLASS_MAPPINGS = {"ViduPromptRecommender": ViduPromptRecommender,"ViduText2Video": ViduText2VideoNode,"ViduImage2Video": ViduImage2VideoNode,"ViduReference2Video": ViduReference2VideoNode,"ViduStartEnd2Video": ViduStartEnd2VideoNode,"ViduFeaturedPreset": ViduFeaturedPresetNode,}
-NODE_DISPLAY_NAME_MAPPINGS = {"ViduPromptRecommender": "comfyui_VIDU_API/推荐提示词","ViduText2Video": "comfyui_VIDU_API/文生视频","ViduImage2Video": "comfyui_VIDU_API/图生视频","ViduReference2Video": "comfyui_VIDU_API/参考生视频","ViduStartEnd2Video": "comfyui_VIDU_API/首尾帧生视频","ViduFeaturedPreset": "comfyui_VIDU_API/特色预设",}
+NODE_CLASS_MAPPINGS = {"ViduPromptRecommender": ViduPromptRecommender,"ViduText2Video": ViduText2VideoNode,"ViduImage2Video": ViduImage2VideoNode,"ViduReference2Video": ViduReference2VideoNode,"ViduStartEnd2Video": ViduStartEnd2VideoNode,"ViduFeaturedPreset": ViduFeaturedPresetNode,"ViduBatch": ViduBatchNode,"ViduTaskRecovery": ViduTaskRecoveryNode,}
+NODE_DISPLAY_NAME_MAPPINGS = {"ViduPromptRecommender": "comfyui_VIDU_API/推荐提示词","ViduText2Video": "comfyui_VIDU_API/文生视频","ViduImage2Video": "comfyui_VIDU_API/图生视频","ViduReference2Video": "comfyui_VIDU_API/参考生视频","ViduStartEnd2Video": "comfyui_VIDU_API/首尾帧生视频","ViduFeaturedPreset": "comfyui_VIDU_API/特色预设","ViduBatch": "comfyui_VIDU_API/批量生成","ViduTaskRecovery": "comfyui_VIDU_API/任务恢复",}